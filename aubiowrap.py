@@ -1,58 +1,145 @@
 import typing as t
 
-import shutil
-import subprocess
+import aubio
+import numpy as np
+
+from cachepack import CACHE_SIZE, cache_key, load, store
 
 """
-Retrieve output from the aubio commandline tools
+Beat, note and pitch analysis with aubio, streamed hop by hop
 """
 
+HOP_SIZE = 256
+ONSET_BUFSIZE = 512
+TEMPO_BUFSIZE = 1024
+PITCH_BUFSIZE = 2048
+PITCH_SILENCE = -90.0
+
+
+def analyse(
+    soundfile: str,
+    beat: t.Optional[bool] = None,
+    pitch: bool = False,
+    notes: bool = False,
+) -> t.Dict[str, np.ndarray]:
+    """
+    Run the requested aubio detectors over soundfile in one decode pass
+
+    :param beat:
+        None skips segmentation, False detects onsets like aubiocut,
+        True tracks beats like aubiocut -b
+    :returns:
+        dict with "beats": onset or beat times in seconds, "pitch": rows of
+        (time, Hz) for every hop and "notes": rows of (midi, start, end)
+    """
+    src = aubio.source(soundfile, 0, HOP_SIZE)
+    rate = src.samplerate
+
+    if beat is None:
+        segmenter = None
+    elif beat:
+        segmenter = aubio.tempo("default", TEMPO_BUFSIZE, HOP_SIZE, rate)
+    else:
+        segmenter = aubio.onset("default", ONSET_BUFSIZE, HOP_SIZE, rate)
+    if pitch:
+        pitcher = aubio.pitch("default", PITCH_BUFSIZE, HOP_SIZE, rate)
+        pitcher.set_unit("Hz")
+        pitcher.set_silence(PITCH_SILENCE)
+        pitch_rows: t.List[t.Tuple[float, float]] = []
+    if notes:
+        noter = aubio.notes("default", ONSET_BUFSIZE, HOP_SIZE, rate)
+        note_rows: t.List[t.List[float]] = []
+
+    beats = []
+    frames = 0
+    while True:
+        samples, read = src()
+        time = frames / rate
+        if segmenter is not None and segmenter(samples):
+            beats.append(segmenter.get_last_s())
+        if pitch:
+            pitch_rows.append((time, pitcher(samples)[0]))
+        if notes:
+            note_on, _, note_off = noter(samples)
+            if (note_on or note_off) and note_rows and note_rows[-1][2] < 0:
+                note_rows[-1][2] = time
+            if note_on:
+                note_rows.append([note_on, time, -1.0])
+        frames += read
+        if read < HOP_SIZE:
+            break
 
-def get_commandline_program(name):
-    program = shutil.which(name)
-    if program is None:
-        raise IOError(f"{name} not found")
+    if notes and note_rows and note_rows[-1][2] < 0:
+        note_rows[-1][2] = frames / rate
 
-    return program
+    result = {}
+    if segmenter is not None:
+        result["beats"] = np.array(beats)
+    if pitch:
+        result["pitch"] = np.array(pitch_rows, dtype=float).reshape(-1, 2)
+    if notes:
+        result["notes"] = np.array(note_rows).reshape(-1, 3)
+    return result
 
 
-def aubiocommand(command: t.Sequence[str], parser: t.Callable = float):
+def get_analysis(
+    soundfile: str,
+    beat: t.Optional[bool] = None,
+    pitch: bool = False,
+    notes: bool = False,
+) -> t.Dict[str, np.ndarray]:
     """
-    Run the command, parse and return its output
+    Cached version of analyse, only decoding the file if anything is missing
     """
-    process = subprocess.Popen(command, stdout=subprocess.PIPE)
-    (out, _) = process.communicate()
-    return [parser(n) for n in out.splitlines() if n]
+    params = {"hop_size": HOP_SIZE}
+    keys = {}
+    if beat is not None:
+        keys["beats"] = cache_key("beats", soundfile, beat=beat, **params)
+    if pitch:
+        keys["pitch"] = cache_key("pitch", soundfile, **params)
+    if notes:
+        keys["notes"] = cache_key("notes", soundfile, **params)
+
+    result = {}
+    if CACHE_SIZE > 0:
+        for kind, key in keys.items():
+            try:
+                result[kind] = load(key)
+            except (FileNotFoundError, ValueError):
+                pass
+
+    missing = keys.keys() - result.keys()
+    if missing:
+        fresh = analyse(
+            soundfile,
+            beat=beat if "beats" in missing else None,
+            pitch="pitch" in missing,
+            notes="notes" in missing,
+        )
+        for kind in missing:
+            if CACHE_SIZE > 0:
+                result[kind] = store(keys[kind], fresh[kind])
+            else:
+                result[kind] = fresh[kind]
+    return result
 
 
 def get_beat(soundfile: str, beat: bool) -> t.Sequence[float]:
     """
-    Get the beat structure using aubiocut
+    Get the onset times, or the beat structure if beat is set
     """
-    args: t.Tuple[str, ...]
-    aubiocut = get_commandline_program("aubiocut")
-
-    if beat:
-        args = (aubiocut, "-b", soundfile)
-    else:
-        args = (aubiocut, soundfile)
-    return aubiocommand(args)
+    return get_analysis(soundfile, beat=beat)["beats"]
 
 
 def get_notes(soundfile: str):
     """
-    Get the list of midi notes using aubionotes
+    Get the list of midi notes as rows of (midi, start, end)
     """
-    aubionotes = get_commandline_program("aubionotes")
-    if aubionotes is None:
-        raise IOError("aubionotes not found")
-
-    return aubiocommand((aubionotes, soundfile))
+    return get_analysis(soundfile, notes=True)["notes"]
 
 
-def get_pitch(soundfile: str, parser: t.Callable):
+def get_pitch(soundfile: str):
     """
-    Get the list of pitch changes using aubiopitch
+    Get the pitch track as rows of (time, frequency)
     """
-    aubiopitch = get_commandline_program("aubiopitch")
-    return aubiocommand((aubiopitch, soundfile), parser)
+    return get_analysis(soundfile, pitch=True)["pitch"]
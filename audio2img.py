@@ -1,15 +1,49 @@
 #!/usr/bin/env python3
-import sys
+import os
+import math
 import argparse
 import cv2
 import numpy as np
 from scipy.io import wavfile
+from renderpack import ImageSink
+from lib import progress
 
 """
 Plot audio samples as pixels in an image bitmap
 """
 
 
+def to_pixels(data):
+    """
+    Map samples to BGR pixels, blue and red from the first channel and
+    green from the second, truncated to 8 bit
+    """
+    if data.ndim == 1:
+        data = data[:, None]
+    channels = [0, min(1, data.shape[1] - 1), 0]
+    return data[:, channels].astype(np.uint8)
+
+
+def bitmap(data, width, height):
+    """Fill a width x height bitmap row by row, padding with black"""
+    pixels = to_pixels(data[: width * height])
+    image = np.zeros((width * height, 3), np.uint8)
+    image[: len(pixels)] = pixels
+    return image.reshape(height, width, 3)
+
+
+def mosaic(data, width, height, columns):
+    """Tile width x height bitmaps in rows of columns, left to right"""
+    tiles = math.ceil(len(data) / (width * height))
+    rows = math.ceil(tiles / columns)
+    image = bitmap(data, width * height * columns, rows)
+    return (
+        image.reshape(rows, columns, height, width, 3)
+        .swapaxes(1, 2)
+        .reshape(rows * height, columns * width, 3)
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="convert audiofile to image bitmap")
     parser.add_argument("soundfile", metavar="soundfile", type=str, help="soundfile")
@@ -19,7 +53,7 @@ if __name__ == "__main__":
         dest="outfile",
         action="store",
         default="/tmp/output.png",
-        help="output file",
+        help="output file, numbered when the audio takes more than one image",
     )
     parser.add_argument(
         "-m",
@@ -46,23 +80,37 @@ if __name__ == "__main__":
         default=720,
         help="height",
     )
+    parser.add_argument(
+        "-M",
+        "--mosaic",
+        dest="mosaic",
+        action="store_true",
+        help="tile all images into one mosaic instead of a numbered sequence",
+    )
+    parser.add_argument(
+        "-c",
+        "--columns",
+        dest="columns",
+        type=int,
+        action="store",
+        help="mosaic columns, defaults to a roughly square mosaic",
+    )
     args = parser.parse_args()
 
-    rate, raw = wavfile.read(args.soundfile)
-    data = np.asarray(raw)
-    if args.width * args.height < len(data):
-        print("bitmap too small")
-        sys.exit(-1)
-
-    bitmap = np.zeros((args.height, args.width, 3), np.uint8)
-    for line in range(args.height):
-        for pixel in range(args.width):
-            linear_pixel = line * args.height + pixel
-            if linear_pixel < len(data):
-                bitmap[line, pixel] = [
-                    data[linear_pixel, 0],
-                    data[linear_pixel, 1],
-                    data[linear_pixel, 0],
-                ]
+    rate, data = wavfile.read(args.soundfile, mmap=True)
+    size = args.width * args.height
+    pages = max(1, math.ceil(len(data) / size))
 
-    cv2.imwrite(args.outfile, bitmap)
+    if pages == 1:
+        cv2.imwrite(args.outfile, bitmap(data, args.width, args.height))
+    elif args.mosaic:
+        columns = args.columns or math.ceil(math.sqrt(pages))
+        cv2.imwrite(args.outfile, mosaic(data, args.width, args.height, columns))
+    else:
+        outdir, filename = os.path.split(args.outfile)
+        root, ext = os.path.splitext(filename)
+        with ImageSink(outdir, name=root + "-{0:05d}", ext=ext[1:]) as sink:
+            for page in range(pages):
+                sink(page, bitmap(data[page * size :], args.width, args.height))
+                progress(page, pages)
+        print("\nwrote {0} images".format(pages))
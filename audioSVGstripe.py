@@ -7,36 +7,102 @@ import sys, os
 import argparse
 from collections import namedtuple
 import numpy as np
-from scipy.io import wavfile
-from drawSvg import Drawing, Path
-from audiopack import pcm2float
-from lib import progress
+from drawSvg import Drawing
+from audiopack import loadwav, get_pyramid, features, count_blocks, get_block
+from renderpack import render_frames, default_jobs
+from svgpack import polyline, simplify, rdp
 
 
-def chunks(l, n):
-    """Yield successive n-sized chunks from l."""
-    for i in range(0, len(l), n):
-        yield l[i : i + n]
+def drawBand(drawing, x, rms, height=400, precision=2):
+    """Draw the RMS at x as a filled band around the center line"""
+    band = np.concatenate(
+        (
+            np.column_stack((x, rms * height * 0.5 + height * 0.5)),
+            np.column_stack((x, height * 0.5 - rms * height * 0.5))[::-1],
+        )
+    )
+    drawing.append(
+        polyline(band, close=True, precision=precision, fill="black", fill_opacity=0.5)
+    )
+    return drawing
 
 
-def drawSamples(drawing, data, width=600, height=400, show_progress=False):
+def drawSamples(
+    drawing,
+    data,
+    width=600,
+    height=400,
+    decimate="minmax+rdp",
+    tolerance=0.5,
+    precision=2,
+    rms=False,
+):
+    """
+    Draw the samples from left to right as one path, reduced with
+    svgpack.simplify so the path size follows the width, not the length.
+    With rms the RMS of every pixel column is drawn as a filled band.
+    """
     size = len(data)
-    grain = width / size
-    path = Path(
+    xy = np.empty((size + 1, 2))
+    xy[0] = 0, height / 2
+    xy[1:, 0] = np.arange(size) * (width / size)
+    xy[1:, 1] = data * height * 0.5 + height * 0.5
+    path = polyline(
+        simplify(xy, decimate, tolerance),
+        precision=precision,
         stroke_width=1,
         stroke="black",
         fill="black",
         fill_opacity=0.0,
     )
-    path.M(0, height / 2)
-    for i, d in enumerate(data):
-        x = i * grain
-        y = d * height * 0.5 + height * 0.5
-        path.L(x, y)
-        if show_progress:
-            progress(i, size)
+    drawing.append(path)
+
+    if rms:
+        blocksize = -(-size // min(size, width))
+        level = features(data, blocksize).rms[0]
+        x = (np.arange(len(level)) + 0.5) * (blocksize * width / size)
+        drawing = drawBand(drawing, np.minimum(x, width), level, height, precision)
+    return drawing
 
+
+def drawSummary(
+    drawing,
+    low,
+    high,
+    rms=None,
+    width=600,
+    height=400,
+    decimate="minmax+rdp",
+    tolerance=0.5,
+    precision=2,
+):
+    """
+    Draw a waveform summary as returned by Pyramid.summary: a vertical
+    stroke from min to max for every column, and the RMS as a filled band
+    """
+    columns = len(low)
+    x = (np.arange(columns) + 0.5) * (width / columns)
+    # zig-zag, so the line does not cross the strokes
+    odd = np.arange(columns) % 2 == 1
+    xy = np.empty((2 * columns + 1, 2))
+    xy[0] = 0, height / 2
+    xy[1::2, 0] = xy[2::2, 0] = x
+    xy[1::2, 1] = np.where(odd, high, low) * height * 0.5 + height * 0.5
+    xy[2::2, 1] = np.where(odd, low, high) * height * 0.5 + height * 0.5
+    if decimate and "rdp" in decimate:
+        xy = rdp(xy, tolerance)
+    path = polyline(
+        xy,
+        precision=precision,
+        stroke_width=1,
+        stroke="black",
+        fill="black",
+        fill_opacity=0.0,
+    )
     drawing.append(path)
+
+    if rms is not None:
+        drawing = drawBand(drawing, x, rms, height, precision)
     return drawing
 
 
@@ -96,15 +162,83 @@ if __name__ == "__main__":
         default=1,
         help="height",
     )
+    parser.add_argument(
+        "-d",
+        "--decimate",
+        dest="decimate",
+        action="store",
+        choices=("none", "minmax", "rdp", "minmax+rdp"),
+        default="minmax+rdp",
+        help="reduce the path to the min and max of every pixel column, "
+        "and/or simplify it with Ramer-Douglas-Peucker",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        dest="tolerance",
+        type=float,
+        action="store",
+        default=0.5,
+        help="Ramer-Douglas-Peucker tolerance in pixels",
+    )
+    parser.add_argument(
+        "-p",
+        "--precision",
+        dest="precision",
+        type=int,
+        action="store",
+        default=2,
+        help="decimals of svg coordinates",
+    )
+    parser.add_argument(
+        "-s",
+        "--start",
+        dest="start",
+        type=float,
+        action="store",
+        default=0.0,
+        help="stripe start in seconds",
+    )
+    parser.add_argument(
+        "-e",
+        "--end",
+        dest="end",
+        type=float,
+        action="store",
+        help="stripe end in seconds, defaults to the end of the file",
+    )
+    parser.add_argument(
+        "-r",
+        "--rms",
+        dest="rms",
+        action="store_true",
+        help="draw the stripe RMS as a filled band",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        action="store",
+        default=default_jobs(),
+        help="number of frames to render in parallel",
+    )
     args = parser.parse_args()
+    decimate = None if args.decimate == "none" else args.decimate
+    path_opts = {
+        "decimate": decimate,
+        "tolerance": args.tolerance,
+        "precision": args.precision,
+    }
+    sample_opts = dict(path_opts, rms=args.rms)
 
     try:
-        rate, raw = wavfile.read(args.soundfile)
+        meta, data = loadwav(args.soundfile, mmap=True)
     except ValueError:
         print("no audiofile provided")
         sys.exit()
 
-    data = pcm2float(raw, "float64")
+    rate = meta.rate
 
     length = namedtuple("length", ["samples", "seconds"])
     length.samples = len(data)
@@ -120,41 +254,67 @@ if __name__ == "__main__":
         channels = 1
         print("Channels: 1")
 
+    start = int(args.start * rate)
+    stop = length.samples if args.end is None else int(args.end * rate)
+    stop = min(max(stop, start + 1), length.samples)
+
     # if outfile is directory, write frames, else one big stripe
     if os.path.isdir(args.outfile):
-        for n, b in enumerate(chunks(data, blocksize)):
+
+        def render(n):
+            b = get_block(data, n, blocksize)
             padded = "{0:06d}".format(n)
-            if len(b) < blocksize:
-                b = np.lib.pad(b, ((blocksize - len(b)) // 2), "constant")
             if args.multichannel and channels > 1:
-                reflect = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
                 for i in range(channels - 1):
                     drawing = Drawing(args.width, args.height)
-                    drawing = drawSamples(drawing, b.T[i], args.width, args.height)
+                    drawing = drawSamples(
+                        drawing, b.T[i], args.width, args.height, **sample_opts
+                    )
             else:
                 if channels > 1:
                     b = b.T[0]
                 drawing = Drawing(args.width, args.height)
-                drawing = drawSamples(drawing, b, args.width, args.height)
-            sys.stdout.write("frame: %s" % padded)
-            sys.stdout.flush()
-            sys.stdout.write("\b" * 13)
+                drawing = drawSamples(
+                    drawing, b, args.width, args.height, **sample_opts
+                )
             drawing.saveSvg(os.path.join("%s/%s.svg" % (args.outfile, padded)))
 
+        render_frames(render, count_blocks(data, blocksize), jobs=args.jobs)
+        sys.stdout.write("\n")
+
+    elif decimate and "minmax" in decimate and stop - start > 2 * args.width:
+        # the stripe comes from the waveform pyramid, at the cost of its width
+        low, high, level = get_pyramid(args.soundfile, data).summary(
+            args.width, start, stop
+        )
+        # like the per sample stripe, which draws each channel but the last
+        # over the one before
+        channel = channels - 2 if args.multichannel and channels > 1 else 0
+        drawing = Drawing(args.width, args.height)
+        drawing = drawSummary(
+            drawing,
+            low[channel],
+            high[channel],
+            level[channel] if args.rms else None,
+            args.width,
+            args.height,
+            **path_opts,
+        )
+        drawing.saveSvg(os.path.join(args.outfile))
+
     else:
+        data = np.asarray(data[start:stop])
         if args.multichannel and channels > 1:
             reflect = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
             for i in range(channels - 1):
                 drawing = Drawing(args.width, args.height)
                 drawing = drawSamples(
-                    drawing, data.T[i], args.width, args.height, show_progress=True
+                    drawing, data.T[i], args.width, args.height, **sample_opts
                 )
         else:
             if channels > 1:
                 data = data.T[0]
             drawing = Drawing(args.width, args.height)
-            drawing = drawSamples(
-                drawing, data, args.width, args.height, show_progress=True
-            )
+            drawing = drawSamples(drawing, data, args.width, args.height, **sample_opts)
         sys.stdout.write("\n")
         drawing.saveSvg(os.path.join(args.outfile))
@@ -9,12 +9,14 @@ from typing import List, Tuple
 from dataclasses import dataclass
 import json
 from os import path
-from aubio import fft, fvec, level_lin
+from aubio import fft, fvec
 import argparse
 import cv2
 import numpy as np
 
-from audiopack import loadwav, audio_chunks
+from audiopack import loadwav, count_blocks, get_block, features
+from cachepack import cached
+from renderpack import render_frames, default_jobs, add_sink_arguments, frame_sink
 
 
 @dataclass
@@ -22,7 +24,7 @@ class Opts:
     radius: int
 
 
-def blob(image, data: Tuple[List, List], opts: Opts):
+def blob(image, data: Tuple[List, List], opts: Opts, levels=None):
     height, width, _ = image.shape
 
     cx = width // 2
@@ -34,8 +36,9 @@ def blob(image, data: Tuple[List, List], opts: Opts):
     s1 = f.rdo(f(fvec(d1)))
     s2 = f.rdo(f(fvec(d2)))
 
-    level_1 = level_lin(fvec(d1))
-    level_2 = level_lin(fvec(d2))
+    if levels is None:
+        levels = (np.mean(np.square(d1)), np.mean(np.square(d2)))
+    level_1, level_2 = levels
 
     for i, j, k, n, rk, rn in zip(d1, d2, s1, s2, reversed(s1), reversed(s2)):
 
@@ -89,30 +92,53 @@ if __name__ == "__main__":
         default=1000,
         help="base radius of the circles",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        action="store",
+        default=default_jobs(),
+        help="number of frames to render in parallel",
+    )
+    add_sink_arguments(parser)
     args = parser.parse_args()
 
-    meta, data = loadwav(args.soundfile)
-
-    data = data * args.amplify
+    meta, data = loadwav(args.soundfile, mmap=True)
 
     blocksize: int = meta.rate // args.fps
     blocks: int = meta.samples // blocksize
 
     opts = Opts(radius=args.radius)
+    levels = cached(
+        "level",
+        args.soundfile,
+        lambda: features(data, blocksize).level,
+        blocksize=blocksize,
+    )
+    levels = levels * args.amplify**2
 
     with open(path.join(args.outdir, "params.json"), "w") as f:
         json.dump(args.__dict__, f)
 
-    for n, block in enumerate(audio_chunks(data, blocksize)):
-        padded = "{0:05d}".format(n)
-        bitmap = np.zeros((args.height, args.width, 3), np.uint8)
+    def render(n, bitmap):
+        block = get_block(data, n, blocksize) * args.amplify
         if meta.channels == 2:
             block_channels = (block.T[0], block.T[1])
+            block_levels = levels[:, n]
         else:
-            block_channels = np.array_split(data, 2)
+            block_channels = np.array_split(block, 2)
+            block_levels = None
 
-        image = blob(bitmap, block_channels, opts)
-        cv2.imwrite(path.join(args.outdir, f"{padded}.png"), image)
+        return blob(bitmap, block_channels, opts, block_levels)
 
-        percent_finished = int(n / blocks * 100)
-        print(f"{percent_finished:>3}%", end="\r", flush=True)
+    sink = frame_sink(
+        args, (args.width, args.height), args.fps, audio=args.soundfile, offset=0
+    )
+    with sink:
+        render_frames(
+            render,
+            count_blocks(data, blocksize),
+            shape=(args.height, args.width, 3),
+            write=sink,
+            jobs=args.jobs,
+        )
@@ -9,7 +9,7 @@ from moviepy.editor import (
     VideoFileClip,
     concatenate_videoclips,
 )  # type: ignore
-from aubiowrap import get_beat, get_pitch
+from aubiowrap import get_analysis
 
 
 Seconds = float
@@ -110,17 +110,12 @@ def is_close(a: float, b: float, tolerance: float = 0.1):
     abs(abs(a) - abs(b)) < tolerance
 
 
-def pitch_parser(line) -> Tuple[float, float]:
-    time, pitch = line.split(b" ")
-    return (float(time), float(pitch))
-
-
 @click.command()
 @click.argument("videofile")
 @click.option("-s", "--soundfile")
 @click.option("-o", "--outfile", default="output.mp4")
 @click.option("-f", "--fps", default=25, type=float)
-@click.option("-b", "--beat", is_flag=True, help="the -b parameter to aubiocut")
+@click.option("-b", "--beat", is_flag=True, help="slice on beats instead of onsets")
 @click.option(
     "-r",
     "--randomize",
@@ -156,8 +151,9 @@ def main(
         probability=probability,
     )
     timeline = Timeline(fps=fps, config=config)
-    timeline.pitches = get_pitch(soundfile, pitch_parser)
-    timeline.beats = get_beat(soundfile, beat)
+    analysis = get_analysis(soundfile, beat=beat, pitch=True)
+    timeline.pitches = analysis["pitch"]
+    timeline.beats = analysis["beats"]
 
     with VideoFileClip(videofile) as clip:
         timeline.add_clip(clip)
@@ -1,11 +1,10 @@
 #!/usr/bin/env python3
 import sys
 import os
-from functools import reduce
 import numpy as np
 import matplotlib.pyplot as plt
-import scipy.io.wavfile as wavfile
-from audiopack import pcm2float
+from audiopack import loadwav, features
+from cachepack import cached
 
 """
 Plot envelope for an audio file
@@ -24,7 +23,7 @@ except:
     outfile = "/tmp/%s.env" % os.path.basename(soundfile)
 
 try:
-    blocksize = sys.argv[3]
+    blocksize = int(sys.argv[3])
 except:
     blocksize = 1764  # 25fps video-blocksize
 
@@ -32,42 +31,18 @@ except:
 # env = np.loadtxt('/tmp/rms.txt')
 # x = np.arange(0, len(env));
 
-rate, data = wavfile.read(soundfile)
-print("Samplerate: %d" % rate)
+meta, data = loadwav(soundfile, mmap=True)
+print("Samplerate: %d" % meta.rate)
+print("Channels: %d" % meta.channels)
+print("Length: %d samples, %d seconds" % (meta.samples, meta.seconds))
 
-# np.asarray(data).astype('float32') / 2 ** 15
-# stangely casues
-# OverflowError: Allocated too many blocks
-# in np.plot with some files
-#
-# normalized = np.asarray(data).astype('float32') / 2 ** 16
-normalized = pcm2float(data, "float64")
-
-length = {}
-length["samples"] = len(normalized)
-length["seconds"] = length["samples"] / float(rate)
-try:
-    channels = data.shape[1]
-except IndexError:
-    channels = 1
-print("Channels: %d" % channels)
-print("Length: %d samples, %d seconds" % (length["samples"], length["seconds"]))
-
-last_frame = length["samples"] // blocksize
+last_frame = meta.samples // blocksize
 frames = np.arange(0, last_frame)
-env = [None] * channels
 
 print("Calculating envelope ...")
-for cnum, chan in enumerate(normalized.T):
-    print("Channel %d" % cnum)
-    env[cnum] = []
-    for i in frames:
-        env[cnum].append(
-            reduce(
-                lambda a, f: a + f * f, chan[i * blocksize : (i + 1) * blocksize], 0.0
-            )
-            / blocksize
-        )
+env = cached(
+    "level", soundfile, lambda: features(data, blocksize).level, blocksize=blocksize
+)[:, :last_frame]
 
 print("Done")
 
@@ -85,11 +60,11 @@ for channel in env:
     plt.plot(frames, channel)
 
 print("Writing to file: %s" % outfile)
+# count frames from 1
+row = "%05d " + ", ".join(["%6f"] * meta.channels) + "\n"
+table = np.column_stack((frames + 1, env.T))
 with open(outfile, "w") as of:
-    for f in frames:
-        ch_frame = ["%6f" % env[i][f] for i in range(len(env))]
-        # count frames from 1
-        of.write("%05d %s\n" % ((f + 1), ", ".join(ch_frame)))
+    of.write("".join(row % tuple(r) for r in table))
 
 # np.savetxt(of, np.array(env), delimiter=",", newline=" ")
 # export_env.tofile(outfile, sep=',', format='%10.5f')
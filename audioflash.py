@@ -4,10 +4,10 @@ import os
 from sys import stdout
 import argparse
 import numpy as np
-from audiopack import loadwav, audio_chunks
-from videopack import render_frame
+from audiopack import loadwav, count_blocks, get_block
+from videopack import render_frame, add_output_arguments, is_raster, output_opts
+from renderpack import render_frames, default_jobs, frame_sink
 from drawSvg import Drawing
-from lib import progress
 
 
 if __name__ == "__main__":
@@ -68,9 +68,28 @@ if __name__ == "__main__":
     )
     parser.add_argument("--use-spec", dest="use_spec", action="store_true")
     parser.add_argument("--long-legs", dest="long_legs", action="store_true")
+    parser.add_argument(
+        "-s",
+        "--seed",
+        dest="seed",
+        type=int,
+        action="store",
+        default=0,
+        help="random seed, every frame is drawn from the seed and its number",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        action="store",
+        default=default_jobs(),
+        help="number of frames to render in parallel",
+    )
+    add_output_arguments(parser)
     args = parser.parse_args()
 
-    meta, data = loadwav(args.soundfile)
+    meta, data = loadwav(args.soundfile, mmap=True)
 
     blocksize = meta.rate // args.fps
     blocks = meta.samples // blocksize
@@ -79,17 +98,21 @@ if __name__ == "__main__":
         os.mkdir(args.outdir)
 
     opts = {
+        **output_opts(args),
         "thickness": args.thickness,
         "use-spec": args.use_spec,
         "long-legs": args.long_legs,
     }
 
-    for n, b in enumerate(audio_chunks(data, blocksize)):
+    def render(n, frame=None):
+        b = get_block(data, n, blocksize)
         padded = "{0:05d}".format(n)
-        drawing = Drawing(args.width, args.height, origin=(0, 0))
-
-        if len(b) < blocksize:
-            b = np.lib.pad(b, ((blocksize - len(b)) // 2), "constant")
+        if frame is None:
+            drawing = Drawing(args.width, args.height, origin=(0, 0))
+        else:
+            drawing = frame
+        # seeded per frame, so frames come out the same in any order
+        rng = np.random.default_rng([args.seed, n])
 
         if args.multichannel and meta.channels > 1:
             reflect = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
@@ -101,7 +124,7 @@ if __name__ == "__main__":
                     width=args.width,
                     height=args.height,
                     reflect=reflect[i % meta.channels],
-                    opts=opts,
+                    opts=dict(opts, rng=rng),
                 )
         else:
             if meta.channels > 1:
@@ -113,10 +136,25 @@ if __name__ == "__main__":
                 plotter="flash",
                 width=args.width,
                 height=args.height,
-                opts={"thickness": args.thickness},
+                opts={**output_opts(args), "thickness": args.thickness, "rng": rng},
             )
 
-        drawing.saveSvg(os.path.join(args.outdir, "audioflash_" + padded + ".svg"))
-        progress(n, blocks)
+        if frame is None:
+            drawing.saveSvg(os.path.join(args.outdir, "audioflash_" + padded + ".svg"))
+
+    count = count_blocks(data, blocksize)
+    if is_raster(args):
+        size = (args.width, args.height)
+        name = "audioflash_{0:05d}"
+        with frame_sink(args, size, args.fps, audio=args.soundfile, name=name) as sink:
+            render_frames(
+                render,
+                count,
+                shape=(args.height, args.width),
+                write=sink,
+                jobs=args.jobs,
+            )
+    else:
+        render_frames(render, count, jobs=args.jobs)
 
     stdout.write("\n")
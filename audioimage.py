@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
-import os
 import argparse
 import cv2
 import numpy as np
 import audiopack as ap
 import lib
+from renderpack import add_sink_arguments, frame_sink
 from itertools import zip_longest
 
 
@@ -111,28 +111,33 @@ if __name__ == "__main__":
     parser.add_argument(
         "-r", "--rate", dest="rate", type=float, action="store", help="rate"
     )
+    add_sink_arguments(parser)
     args = parser.parse_args()
 
     image = np.zeros((args.height, args.width, 3), dtype=np.uint8)
-    meta, audio = ap.loadwav(args.audiofile)
+    meta, audio = ap.loadwav(args.audiofile, mmap=True)
 
     blocksize = meta.rate // args.fps
     blocks = meta.samples // blocksize
     scroll = blocksize // args.height
     last_img = None
-    for i, block in enumerate(ap.audio_chunks(audio, blocksize)):
-        img = last_img if last_img is not None else image
-        img = render_frame(
-            img,
-            block.T[0] if meta.channels > 1 else block,
-            blocksize,
-            args.width,
-            args.height,
-            raw=args.raw,
-        )
-        cv2.imwrite(os.path.join(args.outdir, "{0:05d}.png".format(i + 1)), img)
-        last_img = np.zeros(img.shape, img.dtype)
-        # scroll left
-        last_img[:, 0 : args.width - scroll] = img[:, scroll:]
-        # progress
-        lib.progress(i, blocks)
+    sink = frame_sink(
+        args, (args.width, args.height), args.fps, audio=args.audiofile, offset=1
+    )
+    with sink:
+        for i, block in enumerate(ap.audio_chunks(audio, blocksize)):
+            img = last_img if last_img is not None else image
+            img = render_frame(
+                img,
+                block.T[0] if meta.channels > 1 else block,
+                blocksize,
+                args.width,
+                args.height,
+                raw=args.raw,
+            )
+            sink(i, img)
+            last_img = np.zeros(img.shape, img.dtype)
+            # scroll left
+            last_img[:, 0 : args.width - scroll] = img[:, scroll:]
+            # progress
+            lib.progress(i, blocks)
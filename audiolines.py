@@ -2,9 +2,9 @@
 from __future__ import division
 import os
 import argparse
-import numpy as np
-from audiopack import loadwav, audio_chunks
-from videopack import render_frame
+from audiopack import loadwav, count_blocks, get_block
+from videopack import render_frame, add_output_arguments, is_raster, output_opts
+from renderpack import render_frames, default_jobs, frame_sink
 from drawSvg import Drawing
 
 
@@ -53,19 +53,32 @@ if __name__ == "__main__":
         default=720,
         help="height",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        action="store",
+        default=default_jobs(),
+        help="number of frames to render in parallel",
+    )
+    add_output_arguments(parser)
     args = parser.parse_args()
 
-    meta, data = loadwav(args.soundfile)
+    meta, data = loadwav(args.soundfile, mmap=True)
 
     blocksize = meta.rate // args.fps
     blocks = meta.samples // blocksize
 
-    for n, b in enumerate(audio_chunks(data, blocksize)):
-        padded = "{0:03d}".format(n)
-        drawing = Drawing(args.width, args.height, origin=(0, 0))
+    opts = output_opts(args)
 
-        if len(b) < blocksize:
-            b = np.lib.pad(b, ((blocksize - len(b)) // 2), "constant")
+    def render(n, frame=None):
+        b = get_block(data, n, blocksize)
+        padded = "{0:03d}".format(n)
+        if frame is None:
+            drawing = Drawing(args.width, args.height, origin=(0, 0))
+        else:
+            drawing = frame
         if args.multichannel and meta.channels > 1:
             reflect = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
             for i in range(meta.channels - 1):
@@ -74,11 +87,30 @@ if __name__ == "__main__":
                     b.T[i],
                     width=args.width,
                     height=args.height,
+                    opts=opts,
                     reflect=reflect[i % meta.channels],
                 )
         else:
             if meta.channels > 1:
                 b = b.T[0]
-            drawing = render_frame(drawing, b, width=args.width, height=args.height)
+            drawing = render_frame(
+                drawing, b, width=args.width, height=args.height, opts=opts
+            )
+
+        if frame is None:
+            drawing.saveSvg(os.path.join(args.outdir, "audiolines_" + padded + ".svg"))
 
-        drawing.saveSvg(os.path.join(args.outdir, "audiolines_" + padded + ".svg"))
+    count = count_blocks(data, blocksize)
+    if is_raster(args):
+        size = (args.width, args.height)
+        name = "audiolines_{0:03d}"
+        with frame_sink(args, size, args.fps, audio=args.soundfile, name=name) as sink:
+            render_frames(
+                render,
+                count,
+                shape=(args.height, args.width),
+                write=sink,
+                jobs=args.jobs,
+            )
+    else:
+        render_frames(render, count, jobs=args.jobs)
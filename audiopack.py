@@ -1,8 +1,12 @@
 from typing import Iterator
 from collections import namedtuple
+from functools import lru_cache
 from scipy.io import wavfile
 from scipy.fftpack import rfft
+from scipy.signal import get_window
+import scipy.fft
 import numpy as np
+from cachepack import cached
 
 """
 An audio-visualizing toolbox
@@ -43,12 +47,73 @@ def pcm2float(sig, dtype="float64"):
     i = np.iinfo(sig.dtype)
     abs_max = 2 ** (i.bits - 1)
     offset = i.min + abs_max
-    return (sig.astype(dtype) - offset) / abs_max
+    out = sig.astype(dtype)
+    if offset:
+        out -= offset
+    out *= 1.0 / abs_max
+    return out
 
 
-def loadwav(filename):
-    rate, raw = wavfile.read(filename)
-    data = pcm2float(raw, "float64")
+class PCMSource:
+    """Memory-mapped PCM samples, converted to float one block at a time.
+
+    Behaves like the array returned by ``loadwav`` for ``len()`` and slicing,
+    but only the requested samples are read and converted. Blocks come back
+    planar (fortran ordered), so ``block.T[i]`` is a contiguous channel.
+    """
+
+    def __init__(self, raw, dtype="float64"):
+        self._raw = raw
+        self.dtype = np.dtype(dtype)
+
+    def __len__(self):
+        return len(self._raw)
+
+    @property
+    def shape(self):
+        return self._raw.shape
+
+    @property
+    def ndim(self):
+        return self._raw.ndim
+
+    def __getitem__(self, key):
+        block = np.asfortranarray(self._raw[key])
+        if block.dtype.kind == "f":
+            return block.astype(self.dtype)
+        return pcm2float(block, self.dtype)
+
+    def astype(self, dtype):
+        """The same samples, converted to another float type on access"""
+        return PCMSource(self._raw, dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+
+def loadwav(filename, mmap=False, dtype="float64"):
+    """Load a wav file as floating point samples.
+
+    With ``mmap`` the PCM data is memory-mapped and wrapped in a
+    ``PCMSource``, so memory use stays constant regardless of track length.
+    24 bit files can not be memory-mapped, their PCM data is read whole and
+    still converted block by block. Otherwise the whole file is converted
+    up front. Either way the samples are stored planar, one contiguous
+    array per channel.
+    """
+    try:
+        rate, raw = wavfile.read(filename, mmap=mmap)
+    except ValueError:
+        # scipy only maps 1, 2, 4 and 8 byte samples
+        if not mmap:
+            raise
+        rate, raw = wavfile.read(filename)
+    if mmap:
+        data = PCMSource(raw, dtype)
+    elif raw.dtype.kind == "f":
+        data = np.ascontiguousarray(raw.T, dtype=dtype).T
+    else:
+        data = pcm2float(np.ascontiguousarray(raw.T), dtype).T
     meta = namedtuple("meta", ["rate", "samples", "seconds", "channels"])
     meta.samples = len(data)
     meta.seconds = float(meta.samples) / float(rate)
@@ -60,13 +125,24 @@ def loadwav(filename):
     return meta, data
 
 
+def count_blocks(data, blocksize):
+    """Number of blocks audio_chunks yields"""
+    return -(-len(data) // blocksize)
+
+
+def get_block(data, n, blocksize):
+    """Block n of data, zero padded to blocksize"""
+    block = data[n * blocksize : (n + 1) * blocksize]
+    if len(block) < blocksize:
+        padding = [(0, blocksize - len(block))] + [(0, 0)] * (block.ndim - 1)
+        block = np.asfortranarray(np.pad(block, padding, "constant"))
+    return block
+
+
 def audio_chunks(data, blocksize) -> Iterator:
-    """Yield successive n-sized chunks from l."""
-    for i in range(0, len(data), blocksize):
-        block = data[i : i + blocksize]
-        if len(block) < blocksize:
-            yield np.lib.pad(block, (0, blocksize - len(block)), "constant")
-        yield block
+    """Yield successive blocksize-sized chunks from data, zero padding the last"""
+    for n in range(count_blocks(data, blocksize)):
+        yield get_block(data, n, blocksize)
 
 
 def spectrum(block, N, bins=None):
@@ -74,9 +150,351 @@ def spectrum(block, N, bins=None):
     if bins is None:
         return s
     else:
-        rel = len(s) // bins
-        return [sum(s[i * rel : (i + 1) * rel]) for i in range(bins)]
+        return band_map(N, len(s), bins, nbins=len(s))(s)
+
+
+def stft(data, blocksize, hop=None, window=None, workers=-1, chunk=1024):
+    """Magnitude spectra of the whole signal in one batched pass.
+
+    The signal is framed every ``hop`` samples (default ``blocksize``) as a
+    strided view, weighted by ``window`` (a name understood by
+    ``scipy.signal.get_window`` or an array) and transformed with one real
+    FFT per ``chunk`` frames across all channels, using ``workers`` threads.
+    Frames past the end are zero padded, like ``audio_chunks``.
+
+    Returns
+    -------
+    numpy.ndarray
+        float32 array of shape ``(channels, frames, blocksize // 2 + 1)``,
+        scaled by ``2 / blocksize`` like ``spectrum``.
+    """
+    hop = hop or blocksize
+    channels = 1 if data.ndim == 1 else data.shape[1]
+    frames = max(1, -(-len(data) // hop))
+    if isinstance(window, str):
+        window = get_window(window, blocksize)
+    if isinstance(data, PCMSource):
+        data = data.astype(np.float32)
+
+    out = np.empty((channels, frames, blocksize // 2 + 1), np.float32)
+    for first in range(0, frames, chunk):
+        last = min(first + chunk, frames)
+        start = first * hop
+        length = (last - first - 1) * hop + blocksize
+        planar = np.atleast_2d(np.asarray(data[start : start + length]).T)
+        if planar.shape[1] < length:
+            planar = np.pad(planar, ((0, 0), (0, length - planar.shape[1])))
+        framed = np.lib.stride_tricks.sliding_window_view(planar, blocksize, axis=-1)
+        framed = framed[:, ::hop]
+        if window is not None:
+            framed = framed * window
+        s = scipy.fft.rfft(framed.astype(np.float32), axis=-1, workers=workers)
+        np.multiply(np.abs(s), 2.0 / blocksize, out=out[:, first:last])
+    return out
+
+
+##     ##     ##      ##     ##     ##     ##     ##     ##
+#  #  ##  #  ##  #  ##   #  ##  #  ##  #  ##  #  ##  #  ##  #  #
+#   ##     ##     ##      ##     ##     ##     ##     ##     ##
+##
+### Frequency bands
+##
+#
+LAYOUTS = ("linear", "log", "mel", "bark")
+
+
+def hz2mel(f):
+    return 2595.0 * np.log10(1.0 + f / 700.0)
+
+
+def mel2hz(m):
+    return 700.0 * (10.0 ** (m / 2595.0) - 1.0)
+
+
+def hz2bark(f):
+    """Traunmüller's approximation of the bark scale"""
+    return 26.81 * f / (1960.0 + f) - 0.53
+
+
+def bark2hz(z):
+    return 1960.0 * (z + 0.53) / (26.28 - z)
+
+
+class BandMap:
+    """Sum spectrum bins into bands, along the last axis.
+
+    Band ``i`` covers the bins from ``starts[i]`` up to the next start, the
+    last band ends at ``stop``. Use ``band_map`` to get a cached instance.
+    """
+
+    def __init__(self, starts, stop):
+        self.starts = starts
+        self.stop = stop
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return "<BandMap {0} bands over {1} bins>".format(len(self), self.stop)
+
+    def __call__(self, spec):
+        spec = np.asarray(spec)
+        if self.stop == 0:
+            return np.zeros(spec.shape[:-1] + (len(self),), spec.dtype)
+        return np.add.reduceat(spec[..., : self.stop], self.starts, axis=-1)
+
+
+@lru_cache(maxsize=None)
+def band_map(rate, blocksize, bands, layout="linear", nbins=None) -> BandMap:
+    """Precompute the bin to band reduction of a spectrum.
+
+    Parameters
+    ----------
+    rate : int
+        Samplerate of the analysed signal.
+    blocksize : int
+        FFT size the spectrum was computed with.
+    bands : int
+        Number of bands. Non-linear layouts drop bands that would be
+        narrower than a single bin at the low end.
+    layout : str
+        One of ``LAYOUTS``. ``linear`` sums equal runs of bins, dropping the
+        remainder, the others space the band edges evenly on a log, mel or
+        bark frequency scale.
+    nbins : int, optional
+        Length of the spectrum, ``blocksize // 2 + 1`` by default.
+    """
+    nbins = nbins or blocksize // 2 + 1
+    if layout == "linear":
+        rel = nbins // bands
+        return BandMap(np.arange(bands) * rel, bands * rel)
+
+    nyquist = rate / 2.0
+    if layout == "log":
+        edges = np.geomspace(rate / blocksize, nyquist, bands + 1)
+    elif layout == "mel":
+        edges = mel2hz(np.linspace(0.0, hz2mel(nyquist), bands + 1))
+    elif layout == "bark":
+        edges = bark2hz(np.linspace(hz2bark(0.0), hz2bark(nyquist), bands + 1))
+    else:
+        raise ValueError("unknown band layout: {0}".format(layout))
+
+    starts = (edges[:-1] * blocksize / rate).astype(np.intp)
+    # every band gets at least one bin of its own
+    offsets = np.arange(bands)
+    starts = np.maximum.accumulate(np.maximum(starts, 0) - offsets) + offsets
+    return BandMap(starts[starts < nbins], nbins)
 
 
 def rms(block):
-    return np.sqrt(np.sum(np.apply_along_axis(lambda x: x * x, 0, block)) / len(block))
+    return np.sqrt(np.sum(np.square(block)) / len(block))
+
+
+class Features(namedtuple("Features", ["rms", "peak", "ms"])):
+    """Framewise features, each an array of shape ``(channels, frames)``"""
+
+    __slots__ = ()
+
+    @property
+    def level(self):
+        """Linear level, the same as aubio's ``level_lin``"""
+        return self.ms
+
+
+def features(data, blocksize, chunk=4096) -> Features:
+    """RMS, peak and mean square of every block of every channel.
+
+    Blocks line up with ``audio_chunks``, the last one is zero padded. The
+    signal is read ``chunk`` blocks at a time, each reduced in one pass.
+    """
+    channels = 1 if data.ndim == 1 else data.shape[1]
+    frames = max(1, -(-len(data) // blocksize))
+    ms = np.empty((channels, frames))
+    peak = np.empty((channels, frames))
+    for first in range(0, frames, chunk):
+        last = min(first + chunk, frames)
+        start = first * blocksize
+        length = (last - first) * blocksize
+        planar = np.atleast_2d(np.asarray(data[start : start + length]).T)
+        if planar.shape[1] < length:
+            planar = np.pad(planar, ((0, 0), (0, length - planar.shape[1])))
+        blocks = planar.reshape(channels, last - first, blocksize)
+        ms[:, first:last] = np.einsum("cfb,cfb->cf", blocks, blocks) / blocksize
+        peak[:, first:last] = np.maximum(blocks.max(axis=-1), -blocks.min(axis=-1))
+    return Features(rms=np.sqrt(ms), peak=peak, ms=ms)
+
+
+PYRAMID_BASE = 64
+
+
+def pyramid_counts(length, base=PYRAMID_BASE):
+    """Number of blocks of every pyramid level, up to a single block"""
+    counts = []
+    size = base
+    while True:
+        counts.append(max(1, -(-length // size)))
+        if counts[-1] == 1:
+            return counts
+        size *= 2
+
+
+class Pyramid:
+    """Min, max and mean square of the samples in blocks of ``base * 2**k``.
+
+    All levels are kept in one ``(3, channels, blocks)`` array, level 0
+    first, which is what gets cached. ``summary`` reduces any sample range
+    to a number of columns with work proportional to the columns: every
+    column takes at most two blocks of each level, and at most ``base``
+    samples at either end.
+    """
+
+    def __init__(self, table, length, base=PYRAMID_BASE, data=None):
+        self.table = table
+        self.length = length
+        self.base = base
+        self.data = data
+        self.counts = pyramid_counts(length, base)
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts)))
+
+    def level(self, k):
+        """The (3, channels, blocks) min, max and mean square of level k"""
+        return self.table[:, :, self.offsets[k] : self.offsets[k + 1]]
+
+    def _samples(self, first, last):
+        """
+        The samples first..last of every column, (channels, columns, base)
+        with the positions outside the range masked out
+        """
+        index = first[:, None] + np.arange(self.base)
+        mask = index < last[:, None]
+        index = np.minimum(index, self.length - 1)
+        planar = np.asarray(self.data[index.ravel()]).reshape(index.shape + (-1,))
+        return np.moveaxis(planar, -1, 0), mask
+
+    def summary(self, columns, start=0, stop=None):
+        """Min, max and RMS of each of columns slices of start..stop.
+
+        The slices are split at whole samples. The blocks inside a slice
+        come from the pyramid and the samples of the partial blocks at its
+        ends from the data, so the result is exact. Without the data the
+        ends snap to the nearest base block instead.
+
+        Returns three arrays of shape ``(channels, columns)``.
+        """
+        stop = self.length if stop is None else stop
+        edges = np.round(np.linspace(start, stop, columns + 1)).astype(int)
+        first = np.minimum(edges[:-1], self.length - 1)
+        last = np.minimum(np.maximum(edges[1:], first + 1), self.length)
+
+        # whole base blocks lo..hi, partial blocks before and after them
+        if self.data is None:
+            lo = np.minimum(np.round(first / self.base).astype(int), self.counts[0] - 1)
+            hi = np.maximum(np.round(last / self.base).astype(int), lo + 1)
+        else:
+            lo = -(-first // self.base)
+            hi = np.maximum(last // self.base, lo)
+
+        channels = self.table.shape[1]
+        low = np.full((channels, columns), np.inf)
+        high = np.full((channels, columns), -np.inf)
+        sums = np.zeros((channels, columns))
+        sizes = np.zeros(columns)
+
+        def add(level, size, blocks, take):
+            index = blocks[take]
+            low[:, take] = np.minimum(low[:, take], level[0][:, index])
+            high[:, take] = np.maximum(high[:, take], level[1][:, index])
+            count = np.minimum(size, self.length - index * size)
+            sums[:, take] += level[2][:, index] * count
+            sizes[take] += count
+
+        # split lo..hi like a segment tree, taking the odd blocks at either
+        # end before going up a level
+        a, b = lo.copy(), hi.copy()
+        for k in range(len(self.counts)):
+            level, size = self.level(k), self.base << k
+            take = (a % 2 == 1) & (a < b)
+            add(level, size, a, take)
+            a = a + take
+            take = (b % 2 == 1) & (a < b)
+            b = b - take
+            add(level, size, b, take)
+            a, b = a // 2, b // 2
+
+        if self.data is not None:
+            left_end = np.minimum(lo * self.base, last)
+            right_start = np.maximum(hi * self.base, left_end)
+            for begin, end in ((first, left_end), (right_start, last)):
+                if not np.any(end > begin):
+                    continue
+                samples, mask = self._samples(begin, end)
+                low = np.minimum(low, np.where(mask, samples, np.inf).min(axis=-1))
+                high = np.maximum(high, np.where(mask, samples, -np.inf).max(axis=-1))
+                sums += np.where(mask, np.square(samples), 0).sum(axis=-1)
+                sizes += np.maximum(end - begin, 0)
+
+        return low, high, np.sqrt(sums / sizes)
+
+
+def build_pyramid(data, base=PYRAMID_BASE, chunk=1 << 20) -> Pyramid:
+    """Waveform pyramid of data, computed in one pass over the samples.
+
+    Level 0 is reduced from ``chunk`` samples at a time, every further
+    level from pairs of blocks of the one below.
+    """
+    length = len(data)
+    channels = 1 if data.ndim == 1 else data.shape[1]
+    counts = pyramid_counts(length, base)
+    low = np.empty((channels, counts[0]))
+    high = np.empty((channels, counts[0]))
+    sums = np.zeros((channels, counts[0]))
+    sizes = np.full(counts[0], base)
+    sizes[-1] = length - (counts[0] - 1) * base
+    chunk = max(base, chunk // base * base)
+    for start in range(0, max(length, 1), chunk):
+        planar = np.atleast_2d(np.asarray(data[start : start + chunk]).T)
+        n = planar.shape[1]
+        blocks = -(-n // base)
+        # pad the last block with its last sample, which leaves min and
+        # max alone, and take the padding off the sums again
+        padding = blocks * base - n
+        if n == 0:
+            planar, padding = np.zeros((channels, base)), base
+        elif padding:
+            planar = np.pad(planar, ((0, 0), (0, padding)), "edge")
+        first = start // base
+        shaped = planar.reshape(channels, -1, base)
+        low[:, first : first + blocks] = shaped.min(axis=-1)
+        high[:, first : first + blocks] = shaped.max(axis=-1)
+        squares = np.einsum("cbs,cbs->cb", shaped, shaped)
+        squares[:, -1] -= padding * np.square(planar[:, -1])
+        sums[:, first : first + blocks] = squares
+
+    table = np.empty((3, channels, sum(counts)), np.float32)
+    offset = 0
+    for count in counts:
+        table[0, :, offset : offset + count] = low
+        table[1, :, offset : offset + count] = high
+        table[2, :, offset : offset + count] = sums / sizes
+        offset += count
+        if len(sizes) > 1:
+            if len(sizes) % 2:
+                low = np.concatenate((low, low[:, -1:]), axis=1)
+                high = np.concatenate((high, high[:, -1:]), axis=1)
+                sums = np.concatenate((sums, np.zeros((channels, 1))), axis=1)
+                sizes = np.append(sizes, 0)
+            low = np.minimum(low[:, 0::2], low[:, 1::2])
+            high = np.maximum(high[:, 0::2], high[:, 1::2])
+            sums = sums[:, 0::2] + sums[:, 1::2]
+            sizes = sizes[0::2] + sizes[1::2]
+    return Pyramid(table, length, base, data)
+
+
+def get_pyramid(soundfile, data=None, base=PYRAMID_BASE) -> Pyramid:
+    """The waveform pyramid of soundfile, kept in the analysis cache"""
+    if data is None:
+        _, data = loadwav(soundfile, mmap=True)
+    table = cached(
+        "pyramid", soundfile, lambda: build_pyramid(data, base).table, base=base
+    )
+    return Pyramid(table, len(data), base, data)
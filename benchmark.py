@@ -0,0 +1,612 @@
+#!/usr/bin/env python3
+"""
+Benchmark the analysis functions, renderers and command line tools on
+synthetic test signals and save the timings as JSON
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import chirp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+##
+### Test signals
+##
+#
+def sine(samples, rate, channels, rng):
+    """a chord of three partials, detuned per channel"""
+    t = np.arange(samples) / rate
+    freqs = rng.uniform(55, 5000, 3)
+    out = np.zeros((samples, channels))
+    for c in range(channels):
+        for f in freqs:
+            out[:, c] += np.sin(2 * np.pi * f * (1 + 0.001 * c) * t) / 4
+    return out
+
+
+def sweep(samples, rate, channels, rng):
+    """logarithmic sweep from 20 Hz up to close below nyquist"""
+    t = np.arange(samples) / rate
+    out = chirp(t, 20, max(t[-1], 1 / rate), rate * 0.45, method="logarithmic")
+    return np.repeat(out[:, None] * 0.8, channels, axis=1)
+
+
+def noise(samples, rate, channels, rng):
+    """white noise"""
+    return np.clip(rng.normal(0, 0.25, (samples, channels)), -1, 1)
+
+
+def clicks(samples, rate, channels, rng):
+    """decaying clicks, four per second on average"""
+    out = np.zeros((samples, channels))
+    decay = np.exp(-np.arange(rate // 100) / (rate / 1000))
+    for start in np.nonzero(rng.random(samples) < 4 / rate)[0]:
+        click = decay[: samples - start] * rng.uniform(0.2, 1)
+        out[start : start + len(click)] += click[:, None]
+    return np.clip(out, -1, 1)
+
+
+def silence(samples, rate, channels, rng):
+    return np.zeros((samples, channels))
+
+
+SIGNALS = {
+    "sine": sine,
+    "sweep": sweep,
+    "noise": noise,
+    "clicks": clicks,
+    "silence": silence,
+}
+
+
+def make_signal(kind, seconds, rate=44100, channels=2, seed=0):
+    """A reproducible test signal as (samples, channels) floats in -1..1"""
+    rng = np.random.default_rng(seed)
+    return SIGNALS[kind](int(seconds * rate), rate, channels, rng)
+
+
+def write_signal(filename, kind, seconds, rate=44100, channels=2, seed=0):
+    data = make_signal(kind, seconds, rate, channels, seed)
+    wavfile.write(filename, rate, (data * 32767).astype(np.int16))
+    return filename
+
+
+##
+### Measurements
+##
+#
+class Stages:
+    """Accumulate wall clock time per named stage"""
+
+    def __init__(self):
+        self.times = {}
+
+    @contextmanager
+    def __call__(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times[name] = self.times.get(name, 0.0) + elapsed
+
+
+def rss_mb(usage):
+    # ru_maxrss is in kilobytes on linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return usage.ru_maxrss * scale / 1024**2
+
+
+def result(name, case, frames=None, stages=None, rss=None, error=None):
+    stages = stages or {}
+    total = sum(stages.values())
+    return {
+        "name": name,
+        **case,
+        "frames": frames,
+        "seconds_total": total,
+        "fps": frames / total if frames and total else None,
+        "stages": stages,
+        "peak_rss_mb": rss,
+        "error": error,
+    }
+
+
+##
+### Core functions
+##
+#
+def bench_spectrum(case, data, meta, stage):
+    from audiopack import get_block, spectrum
+
+    blocksize = meta.rate // case["framerate"]
+    for n in range(case["frames"]):
+        with stage("block"):
+            block = get_block(data, n, blocksize)
+        with stage("spectrum"):
+            spectrum(block.T[0], blocksize)
+    return case["frames"]
+
+
+def bench_stft(case, data, meta, stage):
+    from audiopack import stft, count_blocks
+
+    blocksize = meta.rate // case["framerate"]
+    with stage("stft"):
+        stft(data, blocksize)
+    return count_blocks(data, blocksize)
+
+
+def bench_features(case, data, meta, stage):
+    from audiopack import features, count_blocks
+
+    blocksize = meta.rate // case["framerate"]
+    with stage("features"):
+        features(data, blocksize)
+    return count_blocks(data, blocksize)
+
+
+def plotter_bench(plotter):
+    def bench(case, data, meta, stage):
+        from audiopack import get_block
+        from videopack import render_frame
+        from drawSvg import Drawing
+
+        blocksize = meta.rate // case["framerate"]
+        width, height = case["width"], case["height"]
+        opts = {"thickness": 1.0}
+        frame = np.zeros((height, width), np.uint8)
+        for n in range(case["frames"]):
+            with stage("block"):
+                block = get_block(data, n, blocksize).T[0]
+            with stage("plot"):
+                drawing = Drawing(width, height, origin=(0, 0))
+                render_frame(drawing, block, plotter, width, height, opts=opts)
+            with stage("svg"):
+                drawing.asSvg()
+            with stage("raster"):
+                frame[...] = 0
+                render_frame(frame, block, plotter, width, height, opts=opts)
+        return case["frames"]
+
+    return bench
+
+
+def bench_flash(case, data, meta, stage):
+    from flash import make_flash
+
+    for n in range(case["frames"]):
+        with stage("walk"):
+            flashes = make_flash(case["width"], case["height"], 200, False, seed=n)
+        with stage("render_path"):
+            for flash in flashes:
+                flash.render_path(2.0)
+    return case["frames"]
+
+
+def bench_grid(case, data, meta, stage):
+    from grid import Grid
+
+    gol = Grid(width=case["width"] // 4, height=case["height"] // 4)
+    gol.randomize()
+    for _ in range(case["frames"]):
+        with stage("step"):
+            gol.step()
+        with stage("array"):
+            gol.array * 255
+    return case["frames"]
+
+
+def bench_gliders(case, data, meta, stage):
+    from gliders import GliderFlock
+
+    height = case["height"] // 4
+    flock = GliderFlock(width=case["width"] // 4, height=height, size=height // 2)
+    for _ in range(case["frames"]):
+        with stage("step"):
+            flock.step()
+        with stage("array"):
+            flock.array * 255
+    return case["frames"]
+
+
+# name: (benchmark, uses audio, uses resolution)
+FUNCTIONS = {
+    "audiopack.spectrum": (bench_spectrum, True, False),
+    "audiopack.stft": (bench_stft, True, False),
+    "audiopack.features": (bench_features, True, False),
+    "videopack.scatter": (plotter_bench("scatter"), True, True),
+    "videopack.osci": (plotter_bench("osci"), True, True),
+    "videopack.cross": (plotter_bench("cross"), True, True),
+    "videopack.flash": (plotter_bench("flash"), True, True),
+    "Flash.render_path": (bench_flash, False, True),
+    "Grid.step": (bench_grid, False, True),
+    "GliderFlock.step": (bench_gliders, False, True),
+}
+
+
+def _run_function(bench, case, soundfile, seed, conn):
+    from audiopack import loadwav
+
+    random.seed(seed)
+    np.random.seed(seed)
+    stage = Stages()
+    try:
+        if soundfile:
+            with stage("load"):
+                meta, data = loadwav(soundfile, mmap=True)
+        else:
+            meta, data = None, None
+        frames, error = bench(case, data, meta, stage), None
+    except Exception as e:
+        frames, error = None, repr(e)
+    conn.send(
+        (frames, stage.times, rss_mb(resource.getrusage(resource.RUSAGE_SELF)), error)
+    )
+
+
+def run_function(name, case, soundfile, seed):
+    """Run one benchmark in a fresh process, so peak RSS is its own"""
+    bench = FUNCTIONS[name][0]
+    ctx = multiprocessing.get_context("fork")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_function, args=(bench, case, soundfile, seed, child))
+    proc.start()
+    child.close()
+    try:
+        frames, stages, rss, error = parent.recv()
+    except EOFError:
+        proc.join()
+        error = "exit code {0}".format(proc.exitcode)
+        frames, stages, rss = None, {}, None
+    proc.join()
+    return result(name, case, frames, stages, rss, error)
+
+
+##
+### Command line tools
+##
+#
+# name: (argv, uses audio), argv is formatted with the case and paths
+TOOLS = {
+    "spectrum_mask": (["{soundfile}", "-o", "{outdir}", "-j", "{jobs}"], True),
+    "spectrum_sines": (["{soundfile}", "-o", "{outdir}", "-j", "{jobs}"], True),
+    "moving_spectrum": (["{soundfile}", "-o", "{outdir}", "-j", "{jobs}"], True),
+    "audioblob": (["{soundfile}", "-o", "{outdir}", "-j", "{jobs}"], True),
+    "audioimage": (["{soundfile}", "-o", "{outdir}"], True),
+    "audioflash": (["{soundfile}", "-o", "{outdir}", "-j", "{jobs}"], True),
+    "audiolines": (["{soundfile}", "-o", "{outdir}", "-j", "{jobs}"], True),
+    "audiocross": (["{soundfile}", "-o", "{outdir}", "-j", "{jobs}"], True),
+    "audioSVGstripe": (["{soundfile}", "-o", "{outdir}/stripe.svg"], True),
+    "audio2img": (["{soundfile}", "-o", "{outdir}/audio.png"], True),
+    "convolve": (
+        ["{soundfile}", "-i", "{image}", "-o", "{outdir}", "-j", "{jobs}"],
+        True,
+    ),
+    "landscraper": (
+        ["-s", "{soundfile}", "{image}", "{image}", "-o", "{outdir}", "-j", "{jobs}"],
+        True,
+    ),
+    "grid": (["-i", "{frames}", "-o", "{outdir}"], False),
+    "gliders": (["-i", "{frames}", "-o", "{outdir}"], False),
+}
+
+
+def run_process(argv, env, timeout):
+    """Run argv, returning wall time, peak RSS in MB and an error or None"""
+    start = time.perf_counter()
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(argv, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+        # reap the process ourselves for its own resource usage, which
+        # includes the render workers it waited for
+        while True:
+            pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.perf_counter() - start > timeout:
+                proc.kill()
+                os.wait4(proc.pid, 0)
+                proc.returncode = -9
+                return time.perf_counter() - start, None, "timeout"
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        rss = rss_mb(usage)
+        if proc.returncode:
+            stderr.seek(0)
+            lines = stderr.read().decode(errors="replace").strip().splitlines()
+            error = lines[-1] if lines else "exit code {0}".format(proc.returncode)
+            return elapsed, rss, error
+    return elapsed, rss, None
+
+
+def run_tool(name, case, soundfile, image, jobs, timeout):
+    """
+    Run a tool twice on an empty analysis cache, the first (cold) run
+    includes the analysis, the second (warm) run only the rendering
+    """
+    argv, uses_audio = TOOLS[name]
+    stages = {}
+    rss = None
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, VIZZY_CACHE=os.path.join(tmp, "cache"))
+        runs = ("cold", "warm") if uses_audio else ("render",)
+        for run in runs:
+            outdir = os.path.join(tmp, run)
+            os.mkdir(outdir)
+            args = [
+                a.format(
+                    soundfile=soundfile,
+                    image=image,
+                    outdir=outdir,
+                    jobs=jobs,
+                    **case,
+                )
+                for a in argv
+            ]
+            args += ["-W", str(case["width"]), "-H", str(case["height"])]
+            if uses_audio and name not in ("audio2img",):
+                args += ["-f", str(case["framerate"])]
+            elapsed, rss, error = run_process(
+                [sys.executable, os.path.join(HERE, name + ".py")] + args,
+                env,
+                timeout,
+            )
+            stages[run] = elapsed
+            if error:
+                return result(name, case, None, stages, rss, error)
+            frames = len([f for f in os.listdir(outdir) if not f.endswith(".json")])
+    if uses_audio:
+        stages["analysis"] = max(0.0, stages["cold"] - stages["warm"])
+        timed = {"render": stages["warm"], "analysis": stages["analysis"]}
+    else:
+        timed = stages
+    res = result(name, case, frames, timed, rss)
+    res["runs"] = {k: v for k, v in stages.items() if k in runs}
+    return res
+
+
+def write_image(filename, width, height, seed):
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (height, width), np.uint8), (0, 0), 3)
+    cv2.imwrite(filename, image)
+    return filename
+
+
+##
+### Driver
+##
+#
+def cases(args, uses_audio, uses_resolution):
+    signals = args.signals if uses_audio else [None]
+    lengths = args.lengths if uses_audio else [None]
+    resolutions = args.resolutions if uses_resolution else [(None, None)]
+    for signal in signals:
+        for seconds in lengths:
+            for width, height in resolutions:
+                yield {
+                    "signal": signal,
+                    "seconds": seconds,
+                    "width": width,
+                    "height": height,
+                    "framerate": args.fps,
+                    "frames": args.frames,
+                }
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], cwd=HERE, stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def selected(names, only):
+    return [n for n in names if not only or any(o in n for o in only)]
+
+
+def resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def csv(kind):
+    return lambda value: [kind(v) for v in value.split(",") if v]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark renderers and analysis on synthetic signals"
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        dest="outfile",
+        action="store",
+        default="benchmark.json",
+        help="JSON file to write the results to",
+    )
+    parser.add_argument(
+        "-s",
+        "--signals",
+        dest="signals",
+        type=csv(str),
+        action="store",
+        default=["sine", "noise"],
+        help="comma separated test signals: " + ", ".join(SIGNALS),
+    )
+    parser.add_argument(
+        "-l",
+        "--lengths",
+        dest="lengths",
+        type=csv(float),
+        action="store",
+        default=[2.0, 10.0],
+        help="comma separated track lengths in seconds",
+    )
+    parser.add_argument(
+        "-r",
+        "--resolutions",
+        dest="resolutions",
+        type=csv(resolution),
+        action="store",
+        default=[(320, 180), (1280, 720)],
+        help="comma separated frame sizes, e.g. 320x180,1280x720",
+    )
+    parser.add_argument(
+        "-f", "--fps", dest="fps", type=int, action="store", default=25, help="fps"
+    )
+    parser.add_argument(
+        "-n",
+        "--frames",
+        dest="frames",
+        type=int,
+        action="store",
+        default=50,
+        help="frames per renderer benchmark and grid tool run",
+    )
+    parser.add_argument(
+        "--rate",
+        dest="rate",
+        type=int,
+        action="store",
+        default=44100,
+        help="sample rate of the test signals",
+    )
+    parser.add_argument(
+        "--seed", dest="seed", type=int, action="store", default=0, help="seed"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        action="store",
+        default=os.cpu_count() or 1,
+        help="jobs passed to the tools",
+    )
+    parser.add_argument(
+        "-k",
+        "--only",
+        dest="only",
+        type=csv(str),
+        action="store",
+        help="only run benchmarks whose name contains one of these",
+    )
+    parser.add_argument(
+        "--no-tools",
+        dest="tools",
+        action="store_false",
+        help="skip the command line tools",
+    )
+    parser.add_argument(
+        "--no-functions",
+        dest="functions",
+        action="store_false",
+        help="skip the core function benchmarks",
+    )
+    parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=float,
+        action="store",
+        default=600,
+        help="seconds before a tool run is aborted",
+    )
+    args = parser.parse_args()
+
+    unknown = set(args.signals) - SIGNALS.keys()
+    if unknown:
+        parser.error("unknown signals: " + ", ".join(sorted(unknown)))
+
+    results = []
+
+    def report(res):
+        results.append(res)
+        where = " ".join(
+            str(res[k]) for k in ("signal", "seconds", "width", "height") if res[k]
+        )
+        if res["error"]:
+            print("{0:<22} {1:<24} error: {2}".format(res["name"], where, res["error"]))
+        else:
+            print(
+                "{0:<22} {1:<24} {2:8.1f} fps {3:8.1f} MB".format(
+                    res["name"], where, res["fps"] or 0, res["peak_rss_mb"] or 0
+                )
+            )
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        def soundfile(case):
+            if case["signal"] is None:
+                return None
+            filename = os.path.join(tmp, "{signal}-{seconds:g}.wav".format(**case))
+            if not os.path.exists(filename):
+                write_signal(
+                    filename, case["signal"], case["seconds"], args.rate, seed=args.seed
+                )
+            return filename
+
+        if args.functions:
+            for name in selected(FUNCTIONS, args.only):
+                _, uses_audio, uses_resolution = FUNCTIONS[name]
+                for case in cases(args, uses_audio, uses_resolution):
+                    report(run_function(name, case, soundfile(case), args.seed))
+
+        if args.tools:
+            for name in selected(TOOLS, args.only):
+                for case in cases(args, TOOLS[name][1], True):
+                    image = os.path.join(tmp, "{width}x{height}.png".format(**case))
+                    if not os.path.exists(image):
+                        write_image(image, case["width"], case["height"], args.seed)
+                    report(
+                        run_tool(
+                            name,
+                            case,
+                            soundfile(case),
+                            image,
+                            args.jobs,
+                            args.timeout,
+                        )
+                    )
+
+    with open(args.outfile, "w") as f:
+        json.dump(
+            {
+                "date": datetime.now(timezone.utc).isoformat(),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "params": {
+                    k: v for k, v in vars(args).items() if k not in ("outfile",)
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print("saved to {0}".format(args.outfile))
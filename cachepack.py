@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+"""
+Persistent analysis cache
+
+Results are stored as .npy files, named by a hash of the audio content and
+the analysis parameters, and handed back memory-mapped. The least recently
+used entries are evicted once the cache grows beyond VIZZY_CACHE_SIZE bytes
+(default 2 GiB, 0 disables caching). The location is VIZZY_CACHE or
+~/.cache/vizzy.
+"""
+
+CACHE_DIR = os.environ.get(
+    "VIZZY_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "vizzy")
+)
+CACHE_SIZE = int(os.environ.get("VIZZY_CACHE_SIZE", 2 * 1024**3))
+
+_digests = {}
+
+
+def file_digest(filename):
+    """Hash of the file content, memoized on path, size and mtime"""
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+    if key not in _digests:
+        h = hashlib.blake2b(digest_size=16)
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _digests[key] = h.hexdigest()
+    return _digests[key]
+
+
+def cache_key(kind, soundfile=None, **params):
+    """Name of the cache entry for an analysis of soundfile with params"""
+    parts = {"params": params}
+    if soundfile is not None:
+        parts["audio"] = file_digest(soundfile)
+    blob = json.dumps(parts, sort_keys=True, default=str).encode()
+    return "{0}-{1}".format(kind, hashlib.blake2b(blob, digest_size=16).hexdigest())
+
+
+def entry_path(key):
+    return os.path.join(CACHE_DIR, key + ".npy")
+
+
+def load(key):
+    """Memory-map a cached array, raises FileNotFoundError on a miss"""
+    path = entry_path(key)
+    array = np.load(path, mmap_mode="r")
+    os.utime(path)  # mark as recently used
+    return array
+
+
+def store(key, array):
+    """Write array to the cache and return it memory-mapped"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.asarray(array))
+        os.replace(tmp, entry_path(key))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    array = load(key)
+    evict()
+    return array
+
+
+def evict(limit=None):
+    """Remove least recently used entries until the cache fits in limit bytes"""
+    limit = CACHE_SIZE if limit is None else limit
+    try:
+        names = [n for n in os.listdir(CACHE_DIR) if n.endswith(".npy")]
+    except FileNotFoundError:
+        return
+    entries = []
+    for name in names:
+        try:
+            st = os.stat(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.unlink(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def cached(kind, soundfile, compute, **params):
+    """
+    Return the cached result of compute() for soundfile and params,
+    computing and storing it on a miss. compute must return an array.
+    """
+    if CACHE_SIZE <= 0:
+        return np.asarray(compute())
+    key = cache_key(kind, soundfile, **params)
+    try:
+        return load(key)
+    except (FileNotFoundError, ValueError):
+        return store(key, compute())
@@ -6,11 +6,145 @@ import json
 import numpy as np
 from os import path
 from glob import glob
-from itertools import cycle
-from aubio import fvec, level_lin
-from audiopack import loadwav, audio_chunks, spectrum
-from scipy.signal import fftconvolve
+from audiopack import (
+    loadwav,
+    count_blocks,
+    get_block,
+    stft,
+    band_map,
+    features,
+    LAYOUTS,
+)
+from cachepack import cached
+from imagepack import ImageSource, ByteCache
+from renderpack import (
+    render_frames,
+    default_jobs,
+    add_sink_arguments,
+    frame_sink,
+    to_uint8,
+)
+from scipy.signal import oaconvolve
 from scipy.interpolate import interp1d
+import scipy.fft
+
+METHODS = ("auto", "direct", "oa", "fft")
+# kernels up to this many taps are convolved directly
+DIRECT_SIZE = 25
+# overlap-add pays off for kernels this many times smaller than the image
+OA_RATIO = 128
+
+
+class Convolver:
+    """
+    Convolve the images of an ImageSource with a kernel per frame, like
+    fftconvolve(images[n], kernel, mode="same").
+
+    For the kernel shapes passed to prepare, the padded spectrum of every
+    image is cached, so a frame costs one kernel FFT and one inverse. The
+    spectra get what is left of the image budget once the images are
+    loaded, unless budget says otherwise. With method "auto" tiny kernels
+    are convolved directly, and kernels far smaller than the image by
+    overlap-add when there is no cached spectrum. Kernels of a single
+    pixel are always applied directly.
+    """
+
+    def __init__(self, images, method="auto", budget=None):
+        self.images = images
+        self.method = method
+        if budget is None:
+            budget = max(0, images.budget - images.cache.nbytes)
+        self.spectra = ByteCache(budget)
+        self.shapes = set()
+
+    @staticmethod
+    def fft_axes(kernel_shape):
+        """Axes to transform, a kernel one pixel wide needs none across"""
+        return [axis for axis in (0, 1) if kernel_shape[axis] > 1]
+
+    def fft_shape(self, n, kernel_shape):
+        full = np.add(self.images[n].shape, kernel_shape) - 1
+        return [
+            scipy.fft.next_fast_len(int(full[axis]), real=True)
+            for axis in self.fft_axes(kernel_shape)
+        ]
+
+    def spectrum(self, n, kernel_shape):
+        """The padded spectrum of image n for kernels of kernel_shape"""
+        key = (n % len(self.images), tuple(kernel_shape))
+        spectrum = self.spectra.get(key)
+        if spectrum is not None:
+            return spectrum
+        spectrum = scipy.fft.rfftn(
+            self.images[n].astype(float),
+            self.fft_shape(n, kernel_shape),
+            axes=self.fft_axes(kernel_shape),
+        )
+        if key[1] in self.shapes:
+            self.spectra.put(key, spectrum)
+        return spectrum
+
+    def prepare(self, frames, kernel_shape):
+        """
+        Keep spectra for kernels of kernel_shape from now on, and compute
+        those of the images of frames while they fit. Done in the parent
+        process, so every render worker starts out with them.
+        """
+        kernel_shape = tuple(kernel_shape)
+        self.shapes.add(kernel_shape)
+        if self.choose(frames[0], kernel_shape) != "fft":
+            return
+        for n in frames[: len(self.images)]:
+            if self.spectra.full:
+                break
+            self.spectrum(n, kernel_shape)
+
+    def choose(self, n, kernel_shape):
+        if not self.fft_axes(kernel_shape):
+            return "direct"
+        if self.method != "auto":
+            return self.method
+        if np.prod(kernel_shape) <= DIRECT_SIZE:
+            return "direct"
+        small = np.all(np.multiply(kernel_shape, OA_RATIO) <= self.images[n].shape)
+        if small and tuple(kernel_shape) not in self.shapes:
+            return "oa"
+        return "fft"
+
+    def __call__(self, n, kernel):
+        image = self.images[n]
+        method = self.choose(n, kernel.shape)
+        if method == "direct":
+            # filter2D correlates, flip the kernel and anchor it like "same"
+            anchor = (kernel.shape[1] // 2, kernel.shape[0] // 2)
+            return cv2.filter2D(
+                image.astype(float),
+                -1,
+                np.ascontiguousarray(kernel[::-1, ::-1], dtype=float),
+                anchor=anchor,
+                borderType=cv2.BORDER_CONSTANT,
+            )
+        if method == "oa":
+            return oaconvolve(image, kernel, mode="same")
+
+        height, width = image.shape
+        top, left = np.subtract(kernel.shape, 1) // 2
+        fshape = self.fft_shape(n, kernel.shape)
+        if len(fshape) == 1:
+            axis = self.fft_axes(kernel.shape)[0]
+            spectrum = scipy.fft.rfft(kernel, fshape[0], axis=axis)
+            spectrum = spectrum * self.spectrum(n, kernel.shape)
+            full = scipy.fft.irfft(spectrum, fshape[0], axis=axis)
+            return full[top : top + height, left : left + width]
+
+        # transform the rows of the kernel before padding them, and only
+        # transform back the rows that are kept
+        spectrum = scipy.fft.fft(
+            scipy.fft.rfft(kernel, fshape[1], axis=1), fshape[0], axis=0
+        )
+        spectrum *= self.spectrum(n, kernel.shape)
+        rows = scipy.fft.ifft(spectrum, axis=0)[top : top + height]
+        return scipy.fft.irfft(rows, fshape[1], axis=1)[:, left : left + width]
 
 
 if __name__ == "__main__":
@@ -52,6 +186,15 @@ if __name__ == "__main__":
     parser.add_argument(
         "-M", "--mix", dest="mix", action="store_true", help="mix by loudness"
     )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        dest="layout",
+        action="store",
+        choices=LAYOUTS,
+        default="linear",
+        help="frequency band layout when mixing in fft mode",
+    )
     parser.add_argument(
         "-a",
         "--amplify",
@@ -105,9 +248,33 @@ if __name__ == "__main__":
         default=0,
         help="Length in video frames",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        action="store",
+        default=default_jobs(),
+        help="number of frames to render in parallel",
+    )
+    parser.add_argument(
+        "--method",
+        dest="method",
+        action="store",
+        choices=METHODS,
+        default="auto",
+        help="convolution method, auto picks by kernel size",
+    )
+    parser.add_argument(
+        "--atlas",
+        dest="atlas",
+        action="store_true",
+        help="keep the decoded images in the analysis cache for the next run",
+    )
+    add_sink_arguments(parser)
     args = parser.parse_args()
 
-    meta, data = loadwav(args.soundfile)
+    meta, data = loadwav(args.soundfile, mmap=True)
 
     blocksize: int = meta.rate // args.fps
     blocks: int = meta.samples // blocksize
@@ -115,7 +282,8 @@ if __name__ == "__main__":
     start: int = args.start
     length = args.length if args.length > 0 else blocks - start
 
-    files = glob(args.infile)
+    images = ImageSource(glob(args.infile), (args.width, args.height), atlas=args.atlas)
+    images.preload()
     if args.shape:
         try:
             shape = tuple(map(int, args.shape.split(",")))
@@ -138,34 +306,59 @@ if __name__ == "__main__":
         params["amplify"] = amplify
         json.dump(params, f)
 
-    for n, (block, imgfile) in enumerate(
-        zip(audio_chunks(data, blocksize), cycle(files))
-    ):
-        if n < start:
-            continue
-        if n > start + length:
-            break
+    levels = cached(
+        "level",
+        args.soundfile,
+        lambda: features(data, blocksize).level,
+        blocksize=blocksize,
+    )[0]
+    if args.mode == "fft":
+        spec = cached(
+            "stft", args.soundfile, lambda: stft(data, blocksize), blocksize=blocksize
+        )
 
-        padded = "{0:05d}".format(n)
-        bitmap = cv2.imread(imgfile, cv2.IMREAD_GRAYSCALE)
-        level = level_lin(fvec(block.T[0]))
+    def kernel(n):
+        block = get_block(data, n, blocksize)
+        level = levels[n]
 
         if args.mode == "fft" and args.mix:
-            block = spectrum(block, meta.rate, bins=(1 + int(level * blocksize)))
+            bands = band_map(
+                meta.rate, blocksize, 1 + int(level * blocksize), args.layout
+            )
+            block = bands(spec[:, n]).T
         elif args.mode == "fft":
-            block = spectrum(block, meta.rate)
+            block = spec[:, n].T
         elif args.mode == "signal" and args.mix:
             #            block = np.resize(block, (1 + int(level * blocksize), ))
             block = block[0 : 1 + int(level * blocksize)]
+        if block.ndim == 1:
+            # mono, a column like the channels of a stereo block
+            block = block[:, None]
 
         if shape:
             block = np.reshape(block, shape)
         if args.negative:
             block = np.max(block) / 2 - block
 
-        image = fftconvolve(bitmap, block * amplify, mode="same")
+        return block * amplify
+
+    convolver = Convolver(images, args.method)
 
-        cv2.imwrite(path.join(args.outdir, f"{padded}.png"), image)
+    def render(n, frame):
+        return to_uint8(convolver(n, kernel(n)))
 
-        percent_finished = int(n / blocks * 100)
-        print(f"{percent_finished:>3}%", end="\r", flush=True)
+    last = min(count_blocks(data, blocksize), start + length + 1)
+    if not args.mix and last > start:
+        # the kernel shape is the same for every frame, do the images once
+        convolver.prepare(range(start, last), kernel(start).shape)
+    # the soundtrack only lines up with a render from the first frame
+    audio = args.soundfile if start == 0 else None
+    with frame_sink(args, (args.width, args.height), args.fps, audio=audio) as sink:
+        render_frames(
+            render,
+            last,
+            shape=(args.height, args.width),
+            write=sink,
+            jobs=args.jobs,
+            start=start,
+        )
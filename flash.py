@@ -2,8 +2,10 @@ import typing as t
 import click
 import math
 import random
+import numpy as np
 from numpy import dot
-from drawSvg import Drawing, Path
+from drawSvg import Drawing
+from svgpack import polyline
 
 
 def angle_between(v1, v2):
@@ -16,28 +18,37 @@ def angle_between(v1, v2):
         return math.pi
 
 
+def angles_between(ab):
+    """
+    Angles between consecutive edges of a path given as an array of edge
+    vectors (b - a), like angle_between for every pair. Pairs that can
+    not be resolved (rounding beyond +-1, or zero length edges) count as
+    pi.
+    """
+    lengths = np.sqrt(ab[:, 0] ** 2 + ab[:, 1] ** 2)
+    dots = ab[:-1, 0] * ab[1:, 0] + ab[:-1, 1] * ab[1:, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos = dots / (lengths[:-1] * lengths[1:])
+        return np.where(np.abs(cos) <= 1, np.arccos(cos), math.pi)
+
+
 class Point:
+    __slots__ = ("x", "y")
+
     def __init__(self, x=0.0, y=0.0):
-        self._point = (x, y)
+        self.x = x
+        self.y = y
 
     def __repr__(self):
         return "<{0}, {1}>".format(self.x, self.y)
 
-    @property
-    def x(self):
-        return self._point[0]
-
-    @x.setter
-    def x(self, value):
-        self._point[0] = value
+    def __eq__(self, other):
+        if not isinstance(other, Point):
+            return NotImplemented
+        return self.x == other.x and self.y == other.y
 
-    @property
-    def y(self):
-        return self._point[1]
-
-    @y.setter
-    def y(self, value):
-        self._point[1] = value
+    def __hash__(self):
+        return hash((self.x, self.y))
 
     def translate(self, x, y):
         return Point(self.x + x, self.y + y)
@@ -46,19 +57,19 @@ class Point:
         return self.x >= 0 and self.x <= x and self.y >= 0 and self.y <= y
 
     def within_perimeter(self, other, r):
-        return Vector(self, other).length < r
+        return math.sqrt((other.x - self.x) ** 2 + (other.y - self.y) ** 2) < r
 
 
 class Vector:
-    _vector: t.Tuple[Point, Point]
+    __slots__ = ("a", "b")
 
     def __init__(self, a: Point, b: Point):
         if not isinstance(a, Point):
             raise TypeError("a must be Point")
         elif not isinstance(b, Point):
             raise TypeError("b must be Point")
-        else:
-            self._vector = (a, b)
+        self.a = a
+        self.b = b
 
     def __repr__(self) -> str:
         return f"<Vector {self.a}, {self.b}>"
@@ -78,22 +89,6 @@ class Vector:
         """
         return (self.a.x - self.b.x, self.a.y - self.b.y)
 
-    @property
-    def a(self) -> Point:
-        return self._vector[0]
-
-    @a.setter
-    def a(self, value: Point):
-        self._vector = (value, self._vector[1])
-
-    @property
-    def b(self) -> Point:
-        return self._vector[1]
-
-    @b.setter
-    def b(self, value: Point):
-        self._vector = (self._vector[0], value)
-
     @property
     def ab(self):
         return self.b.x - self.a.x, self.b.y - self.a.y
@@ -119,6 +114,11 @@ class Vector:
 
 
 class Flash:
+    """
+    Zig-zag path from start towards end. The node coordinates are kept in
+    a growable (n, 2) array, Points are made on access.
+    """
+
     __alternate = 0
 
     def __init__(self, width=500, height=500, start=None, end=None):
@@ -126,28 +126,35 @@ class Flash:
         self.height = height
         self.start = start or Point(width // 2, height)
         self.end = end or Point(width // 2, 0)
-        self._nodes: t.List[Point] = []
-        self._nodes.append(self.start)
+        self._xy = np.empty((16, 2))
+        self._count = 0
+        self._flashes: t.List["Flash"] = []
+        self.add_node(self.start)
 
     def __str__(self):
-        return " → ".join(map(str, self._nodes))
+        return " → ".join(map(str, self.points))
 
     def __repr__(self):
         return "<Flash {}>".format(id(self))
 
     def __len__(self):
-        return len(self._nodes)
+        return self._count + len(self._flashes)
+
+    @property
+    def coordinates(self):
+        """The (n, 2) array of node coordinates"""
+        return self._xy[: self._count]
 
     @property
     def current_node(self):
-        return self._nodes[-1:][0]
+        return self.current_point()
 
     @property
     def random_node(self):
-        return self._nodes[random.randint(0, len(self._nodes) - 1)]
+        return Point(*self._xy[random.randint(0, self._count - 1)].tolist())
 
     def current_point(self):
-        return self.points[-1:][0]
+        return Point(*self._xy[self._count - 1].tolist())
 
     def random_point(self, x=10, y=10):
         current = self.current_point()
@@ -172,10 +179,9 @@ class Flash:
         """
 
         def next_node(length):
-            try:
-                a, b = self.points[-2:]
-            except ValueError:
+            if self._count < 2:
                 return self.random_point(10, 10)
+            b = self.current_point()
 
             deflect = random.random() * (1.0 - mix) + data * mix
 
@@ -207,74 +213,115 @@ class Flash:
                 break
         self.add_node(node)
 
+    def walk(self, lengths, deflect, factor, jitter, perimeter=0.0):
+        """
+        random_walk for a batch of steps at once, drawn beforehand as arrays.
+        Steps that head for the end aim from the node the batch starts at,
+        nodes leaving the canvas are reflected back in. Stops after the
+        first node within perimeter of the end.
+
+        :returns: the number of steps taken
+        """
+        current = self.coordinates[-1]
+        heading = math.atan2(self.end.y - current[1], self.end.x - current[0])
+        angle = np.where(
+            factor == 0,
+            heading + (deflect - 0.5),
+            math.pi / 2 - factor * deflect * math.pi / 2,
+        )
+        length = np.where(factor == 0, lengths**2, lengths)
+        steps = np.column_stack((np.cos(angle), np.sin(angle))) * length[:, None]
+        if self._count < 2:
+            steps[0] = jitter[0]
+        xy = current + np.cumsum(steps, axis=0)
+        xy[:, 0] = fold(xy[:, 0], self.width)
+        xy[:, 1] = fold(xy[:, 1], self.height)
+
+        near = np.hypot(xy[:, 0] - self.end.x, xy[:, 1] - self.end.y) < perimeter
+        taken = int(np.argmax(near)) + 1 if near.any() else len(xy)
+        self.add_nodes(xy[:taken])
+        return taken
+
+    def add_nodes(self, xy):
+        """Append an (n, 2) array of node coordinates"""
+        count = self._count + len(xy)
+        if count > len(self._xy):
+            size = 1 << (count - 1).bit_length()
+            self._xy = np.concatenate((self._xy, np.empty((size - len(self._xy), 2))))
+        self._xy[self._count : count] = xy
+        self._count = count
+
     def add_node(self, node=None):
         if node is None:
             node = self.random_point()
-        self._nodes.append(node)
+        if isinstance(node, Flash):
+            self._flashes.append(node)
+            return
+        if self._count == len(self._xy):
+            self._xy = np.concatenate((self._xy, np.empty_like(self._xy)))
+        self._xy[self._count] = node.x, node.y
+        self._count += 1
 
     @property
     def flashes(self):
-        return [n for n in self._nodes if isinstance(n, Flash)]
+        return list(self._flashes)
 
     @property
     def points(self):
-        return [n for n in self._nodes if isinstance(n, Point)]
+        return [Point(x, y) for x, y in self.coordinates.tolist()]
 
     @property
     def edges(self):
-        return [Vector(self.points[i], p) for i, p in enumerate(self.points[1:])]
+        points = self.points
+        return [Vector(a, b) for a, b in zip(points, points[1:])]
 
     @property
     def path(self):
-        path = Path(
+        return polyline(
+            self.coordinates,
             stroke_width=1,
             stroke="black",
             fill="black",
             fill_opacity=0.0,
             stroke_miterlimit=25,  # keep it pointy
         )
-        path.M(self.start.x, self.start.y)
-        for node in self.points[1:]:
-            path.L(node.x, node.y)
 
-        return path
-
-    def render_path(self, thickness=1.0):
+    def backflash(self, thickness=1.0):
+        """
+        Return path offsets: each inner node moved by the angle between
+        its edges, further for nodes later in the flash
+        """
+        xy = self.coordinates
+        if len(xy) < 3:
+            return np.empty((0, 2))
+        phi = angles_between(np.diff(xy, axis=0))
+        i = np.arange(len(phi))
+        distance = thickness - (thickness / (i + 1))
+        offset = np.column_stack((np.cos(phi), np.sin(phi))) * distance[:, None]
+        return xy[1:-1] + offset
+
+    def outline(self, thickness=1.0):
+        """The filled shape of render_path as an (n, 2) array"""
+        return np.concatenate((self.coordinates, self.backflash(thickness)[::-1]))
+
+    def render_path(self, thickness=1.0, precision=2):
         """
         Render double lined, filled flash path
         """
-        path = Path(
+        return polyline(
+            self.outline(thickness),
+            close=True,
+            precision=precision,
             stroke_width=1,
             stroke="black",
             fill="black",
             fill_opacity=1.0,
             stroke_miterlimit=99,  # keep it pointy
         )
-        path.M(self.start.x, self.start.y)
-
-        for node in self.points[1:]:
-            path.L(node.x, node.y)
-
-        backflash = []
-        for i, v1 in enumerate(self.edges):
-            lp = len(self.points)
-            if i < lp - 2:
-                v2 = self.edges[i + 1]
-                assert v1.b == v2.a
-                phi = angle_between(v1, v2)
-                distance = thickness - (thickness / (i + 1))
-                point = Vector.from_polar(v1.b, phi, distance)
-                backflash.append(point)
 
-        for p in reversed(backflash):
-            path.L(p.b.x, p.b.y)
-
-        path.Z()
-        return path
-
-    def render(self, drawing=None, thickness=1.0):
+    def render(self, drawing=None, thickness=1.0, precision=2):
         drawing = drawing or Drawing(self.width, self.height, origin=(0, 0))
-        drawing.append(self.render_path(thickness))
+        drawing.append(self.render_path(thickness, precision))
         return drawing
 
 
@@ -282,23 +329,69 @@ def random_point(max_x: int, max_y: int) -> Point:
     return Point(int(random.random() * max_x), int(random.random() * max_y))
 
 
-def make_flash(width, height, nodes, verbose):
-    flash = Flash(width=width, height=height)
-    first_flash = flash
+def fold(x, limit):
+    """Reflect coordinates back into 0..limit, as often as needed"""
+    x = np.mod(x, 2 * limit)
+    return limit - np.abs(x - limit)
+
+
+# steps drawn and walked at a time, the heading towards the end is
+# updated between batches
+WALK_BATCH = 32
+
+
+def lightning(width, height, lengths, rng, end=None, perimeter=None):
+    """
+    Grow a lightning tree with one step per entry of lengths, 0 meaning a
+    random length of 1..10. Once the current flash is within perimeter of
+    its end, the next step starts a new flash from a random node of the
+    first one towards end(rng, branch), branch counting from 0.
+
+    All randomness comes from the numpy Generator rng, so a tree is
+    reproducible from its seed.
+    """
+    lengths = np.asarray(lengths, dtype=float)
+    nodes = len(lengths)
+    if perimeter is None:
+        perimeter = height / 20
+    if end is None:
+
+        def end(rng, branch):
+            return Point(int(rng.random() * width), int(rng.random() * height / 2))
+
+    deflect = rng.random(nodes)
+    factor = rng.integers(-1, 2, nodes)
+    lengths = np.where(lengths == 0, rng.integers(1, 11, nodes), lengths)
+    jitter = rng.integers(1, 11, (nodes, 2)) - 5
+
+    first = flash = Flash(width=width, height=height)
     flashes = [flash]
-    for _ in range(nodes):
-        if flash.current_point().within_perimeter(flash.end, height / 20):
+    i = 0
+    while i < nodes:
+        if flash.current_point().within_perimeter(flash.end, perimeter):
+            nodes_xy = first.coordinates
+            start = Point(*nodes_xy[rng.integers(len(nodes_xy))].tolist())
             flash = Flash(
                 width=width,
                 height=height,
-                start=first_flash.random_node,
-                end=random_point(width, height / 2),
+                start=start,
+                end=end(rng, len(flashes) - 1),
             )
-            if verbose:
-                click.echo(f"new flash started {flash}")
-
             flashes.append(flash)
-        flash.random_walk()
+            i += 1
+            continue
+        batch = slice(i, i + WALK_BATCH)
+        i += flash.walk(
+            lengths[batch], deflect[batch], factor[batch], jitter[batch], perimeter
+        )
+    return flashes
+
+
+def make_flash(width, height, nodes, verbose, seed=None):
+    flashes = lightning(width, height, np.zeros(nodes), np.random.default_rng(seed))
+    if verbose:
+        for flash in flashes[1:]:
+            click.echo(f"new flash started {flash}")
     return flashes
 
 
@@ -307,10 +400,13 @@ def make_flash(width, height, nodes, verbose):
 @click.option("-w", "--width", type=int, default=500)
 @click.option("-h", "--height", type=int, default=500)
 @click.option("-o", "--outfile", default="/tmp/flash.svg")
+@click.option("-s", "--seed", type=int, help="random seed")
 @click.option("-v", "--verbose", is_flag=True)
-def main(nodes, width, height, outfile, verbose):
+def main(nodes, width, height, outfile, seed, verbose):
     drawing = Drawing(width, height, origin=(0, 0))
-    flashes = make_flash(width=width, height=height, nodes=nodes, verbose=verbose)
+    flashes = make_flash(
+        width=width, height=height, nodes=nodes, verbose=verbose, seed=seed
+    )
     for flash in flashes:
         drawing.append(flash.render_path())
 
@@ -1,77 +1,70 @@
 # /usr/bin/env python3
 from sys import stdout
 import argparse
-import os
-import cv2
-import random
+import numpy as np
 from grid import Grid
 from lib import progress
+from renderpack import add_sink_arguments, frame_sink
 
+# brightness of the trail, newest position first
+FADE = (1, 1, 1, 1, 1, 1, 0.9, 0.8, 0.4, 0.1)
 
-class Glider(object):
-
-    def __init__(self, width, height, x=None, y=None, length=10, speed=1):
-        self.width = width
-        self.height = height
-        self.length = length
-        self.speed = speed
-        self.x = random.randint(0, width - 1) if x is None else x
-        self.y = random.randint(0, width - 1) if y is None else y
-        self.direction = self.direction_vector(random.randint(0, 3))
-        self.trail = []
-
-    def direction_vector(self, index):
-        return ((1, 0), (0, 1), (-1, 0), (0, -1))[index]
-
-    def turn_left(self):
-        self.direction = (-self.direction[1], self.direction[0])
-
-    def turn_right(self):
-        self.direction = (self.direction[1], -self.direction[0])
-
-    def move(self):
-        self.trail = ([(self.x, self.y)] + self.trail)[: self.length]
-        self.x = (self.x + self.speed * self.direction[0]) % self.width
-        self.y = (self.y + self.speed * self.direction[1]) % self.height
-
-    def add_to_grid(self, grid):
-        grid[self.y][self.x] = 1
-        for i, (x, y) in enumerate(self.trail):
-            grid[y][x] = (1, 1, 1, 1, 1, 1, 0.9, 0.8, 0.4, 0.1)[i]
-        return grid
+# right, down, left, up
+DIRECTIONS = np.array(((1, 0), (0, 1), (-1, 0), (0, -1)))
 
 
 class GliderFlock(Grid):
+    """
+    Gliders walking the board, turning at random and leaving fading
+    trails. The flock is kept as arrays, one entry per glider, and the
+    trails as a ring buffer of the last length positions.
+    """
+
+    dtype = np.float32
 
-    def __init__(self, width=100, height=100, length=10, size=50, speed=None):
+    def __init__(
+        self, width=100, height=100, length=10, size=50, speed=None, seed=None
+    ):
         super().__init__(width, height)
-        self._gliders = [
-            Glider(
-                self.width,
-                self.height,
-                length=length,
-                x=0,
-                y=(i - size // 2) + self.height // 2,
-                speed=speed or random.randint(1, 5),
-            )
-            for i in range(size)
-        ]
+        self._rng = np.random.default_rng(seed)
+        self.length = length
+        self.x = np.zeros(size, np.intp)
+        self.y = (np.arange(size) - size // 2 + self.height // 2) % self.height
+        self.dx, self.dy = DIRECTIONS[self._rng.integers(0, 4, size)].T
+        self.speed = np.full(size, speed) if speed else self._rng.integers(1, 6, size)
+        self.trail_x = np.zeros((length, size), np.intp)
+        self.trail_y = np.zeros((length, size), np.intp)
+        self.fade = np.array(
+            FADE[:length] + FADE[-1:] * (length - len(FADE)), self.dtype
+        )
+        self._steps = 0
 
-    def step(self):
-        grid = []
-        for y, row in enumerate(self._grid):
-            grid.append(row.copy())
+    def turn(self):
+        rand = self._rng.integers(0, 101, len(self.x))
+        left = rand > 95
+        right = (rand > 90) & ~left
+        self.dx[left], self.dy[left] = -self.dy[left], self.dx[left]
+        self.dx[right], self.dy[right] = self.dy[right], -self.dx[right]
 
-        for g in self._gliders:
-            rand = random.randint(0, 100)
-            if rand > 95:
-                g.turn_left()
-            elif rand > 90:
-                g.turn_right()
-            g.move()
-            grid = g.add_to_grid(grid)
+    def move(self):
+        slot = self._steps % self.length
+        self.trail_x[slot] = self.x
+        self.trail_y[slot] = self.y
+        self._steps += 1
+        self.x = (self.x + self.speed * self.dx) % self.width
+        self.y = (self.y + self.speed * self.dy) % self.height
 
-        self._grid = grid
+    def step(self):
+        self.turn()
+        self.move()
+        # heads, then the trail from the newest position on, each glider
+        # after the other like they were drawn one by one
+        age = np.arange(min(self._steps, self.length))
+        slots = (self._steps - 1 - age) % self.length
+        ys = np.vstack((self.y, self.trail_y[slots])).T
+        xs = np.vstack((self.x, self.trail_x[slots])).T
+        values = np.concatenate(([1], self.fade[age])).astype(self.dtype)
+        self._grid[ys, xs] = np.broadcast_to(values, ys.shape)
 
 
 if __name__ == "__main__":
@@ -137,6 +130,23 @@ if __name__ == "__main__":
         action="store",
         help="glider speed. if not specified, speed is randomized 1..5",
     )
+    ap.add_argument(
+        "-f",
+        "--fps",
+        dest="fps",
+        type=int,
+        action="store",
+        default=25,
+        help="frames per second of the video",
+    )
+    ap.add_argument(
+        "--seed",
+        dest="seed",
+        type=int,
+        action="store",
+        help="random seed",
+    )
+    add_sink_arguments(ap)
     args = ap.parse_args()
 
     flock = GliderFlock(
@@ -145,13 +155,13 @@ if __name__ == "__main__":
         length=args.length,
         size=args.size,
         speed=args.speed,
+        seed=args.seed,
     )
 
-    for i in range(args.iterations):
-        flock.step()
-        cv2.imwrite(
-            os.path.join(args.outdir, "{:05d}.png".format(i)), flock.array * 255
-        )
-        progress(i, args.iterations)
+    with frame_sink(args, (args.width, args.height), args.fps) as sink:
+        for i in range(args.iterations):
+            flock.step()
+            sink(i, flock.array * 255)
+            progress(i, args.iterations)
 
     stdout.write("\n")
@@ -1,27 +1,215 @@
 from sys import stdout
 import argparse
-import os
+import hashlib
 import cv2
 import numpy as np
-import random
+from functools import lru_cache
+from scipy import fft
 from lib import progress
+from renderpack import add_sink_arguments, frame_sink
+
+
+RULES = {
+    "gol": "B3/S23",  # conways game of life
+    "gul": "B1357/S1357",  # odd neighbour count
+}
+
+
+@lru_cache()
+def parse_rule(rule):
+    """
+    Lookup table for a life-like rule, either a name from RULES or a
+    B/S string like B36/S23. The table is indexed by alive * 9 + neighbours.
+    """
+    rule = RULES.get(rule, rule)
+    try:
+        born, survive = rule.upper().split("/")
+        assert born[0] == "B" and survive[0] == "S"
+        # a cell has at most 8 neighbours
+        assert set(born[1:] + survive[1:]) <= set("012345678")
+        table = np.zeros(18, np.uint8)
+        table[[int(n) for n in born[1:]]] = 1
+        table[[9 + int(n) for n in survive[1:]]] = 1
+    except (AssertionError, IndexError, ValueError):
+        raise ValueError("rule must be one of {0} or like B3/S23".format(list(RULES)))
+    return table
+
+
+def box(radius):
+    """Square neighbourhood, the Moore neighbourhood for radius 1"""
+    return np.ones((2 * radius + 1, 2 * radius + 1))
+
+
+def disc(radius):
+    y, x = np.ogrid[-radius : radius + 1, -radius : radius + 1]
+    return (np.hypot(x, y) <= radius + 0.5).astype(float)
+
+
+def ring(radius, inner):
+    """Cells between the inner and outer radius"""
+    y, x = np.ogrid[-radius : radius + 1, -radius : radius + 1]
+    r = np.hypot(x, y)
+    return ((r <= radius + 0.5) & (r > inner + 0.5)).astype(float)
+
+
+def shells(radius, peaks=(1.0,)):
+    """
+    Smooth Lenia kernel: concentric bumps, one per peak weight, normalized
+    to sum to 1
+    """
+    y, x = np.ogrid[-radius : radius + 1, -radius : radius + 1]
+    r = np.hypot(x, y) / radius * len(peaks)
+    shell = np.minimum(r.astype(int), len(peaks) - 1)
+    frac = r - shell
+    with np.errstate(divide="ignore", over="ignore"):
+        bump = np.exp(4 - 1 / (frac * (1 - frac)))
+    weights = np.where((r < len(peaks)) & (frac > 0), np.take(peaks, shell) * bump, 0)
+    return weights / weights.sum()
+
+
+class Kernel:
+    """
+    Neighbourhood weights, summed over a toroidal board by FFT
+    convolution. The kernel's FFT is cached per board shape, so the cost
+    of a step does not depend on the radius.
+    """
+
+    def __init__(self, weights):
+        self.weights = np.asarray(weights, np.float32)
+        self._ffts = {}
+
+    def fft(self, shape):
+        if shape not in self._ffts:
+            # center the kernel on cell (0, 0), wrapping around the board
+            ky, kx = self.weights.shape
+            ys = (np.arange(ky) - ky // 2) % shape[0]
+            xs = (np.arange(kx) - kx // 2) % shape[1]
+            padded = np.zeros(shape, np.float32)
+            np.add.at(padded, np.ix_(ys, xs), self.weights)
+            self._ffts[shape] = fft.rfft2(padded, workers=-1)
+        return self._ffts[shape]
+
+    def __call__(self, board):
+        spectrum = fft.rfft2(board.astype(np.float32), workers=-1)
+        spectrum *= self.fft(board.shape)
+        return fft.irfft2(spectrum, s=board.shape, workers=-1)
+
+
+def moore(board):
+    """Live cells and their live neighbour count, wrapping around the edges"""
+    alive = (board > 0).view(np.uint8)
+    rows = alive + np.roll(alive, 1, 0)
+    rows += np.roll(alive, -1, 0)
+    counts = rows + np.roll(rows, 1, 1)
+    counts += np.roll(rows, -1, 1)
+    counts -= alive
+    return alive, counts
+
+
+class LifeRule:
+    """Life-like B/S rule on the Moore neighbourhood"""
+
+    continuous = False
+
+    def __init__(self, rule):
+        self.table = parse_rule(rule)
+
+    def __call__(self, board):
+        alive, counts = moore(board)
+        counts += 9 * alive
+        return self.table.take(counts).astype(board.dtype, copy=False)
+
+
+class LargerThanLife:
+    """
+    Binary rule with a large neighbourhood: a cell is born when the
+    number of live cells under the kernel is in the born range and
+    survives when it is in the survive range (both inclusive)
+    """
+
+    continuous = False
+
+    def __init__(self, kernel, born, survive, middle=False):
+        weights = np.array(kernel, float)
+        if not middle:
+            weights[weights.shape[0] // 2, weights.shape[1] // 2] = 0
+        self.kernel = Kernel(weights)
+        self.born = born
+        self.survive = survive
+
+    def __call__(self, board):
+        alive = board > 0
+        counts = np.rint(self.kernel(alive))
+        born = (counts >= self.born[0]) & (counts <= self.born[1])
+        survive = (counts >= self.survive[0]) & (counts <= self.survive[1])
+        return np.where(alive, survive, born).astype(board.dtype)
+
+
+class Lenia:
+    """
+    Continuous cells in 0..1, moved towards the growth center mu of the
+    smooth kernel's weighted neighbourhood average
+    """
+
+    continuous = True
+
+    def __init__(self, radius=13, mu=0.15, sigma=0.015, dt=0.1, peaks=(1.0,)):
+        self.kernel = Kernel(shells(radius, peaks))
+        self.mu = mu
+        self.sigma = sigma
+        self.dt = dt
+
+    def __call__(self, board):
+        potential = self.kernel(board)
+        growth = 2 * np.exp(-((potential - self.mu) ** 2) / (2 * self.sigma**2)) - 1
+        return np.clip(board + self.dt * growth, 0, 1).astype(np.float32)
+
+
+NEIGHBOURHOODS = {"M": box, "C": disc}
+
+
+@lru_cache()
+def make_rule(rule):
+    """
+    Rule object for a name from RULES, a B/S string, "lenia", or a larger
+    than life rule like R5,B34..45,S34..58 with an optional M1 to count
+    the cell itself and NM (box, default) or NC (disc) neighbourhood
+    """
+    if rule == "lenia":
+        return Lenia()
+    if not rule.upper().startswith("R"):
+        return LifeRule(rule)
+    try:
+        parts = {p[0]: p[1:] for p in rule.upper().split(",")}
+        radius = int(parts["R"])
+        born = tuple(map(int, parts["B"].split("..")))
+        survive = tuple(map(int, parts["S"].split("..")))
+        neighbourhood = NEIGHBOURHOODS[parts.get("N", "M")]
+        assert len(born) == len(survive) == 2
+    except (AssertionError, IndexError, KeyError, ValueError):
+        raise ValueError("larger than life rules look like R5,B34..45,S34..58")
+    return LargerThanLife(
+        neighbourhood(radius), born, survive, middle=parts.get("M") == "1"
+    )
 
 
 class Grid:
+    dtype = np.uint8
 
     def __init__(self, width=20, height=20):
         self.width = width
         self.height = height
         self.clear()
 
-    def randomize(self):
-        self._grid = [
-            [random.randint(0, 1) for cell in range(self.width)]
-            for line in range(self.height)
-        ]
+    def randomize(self, continuous=False):
+        shape = (self.height, self.width)
+        if continuous:
+            self._grid = np.random.random(shape).astype(np.float32)
+        else:
+            self._grid = np.random.randint(0, 2, shape).astype(self.dtype)
 
     def clear(self):
-        self._grid = [[0 for cell in range(self.width)] for line in range(self.height)]
+        self._grid = np.zeros((self.height, self.width), self.dtype)
 
     def glider(self):
         self.set_cell(0, 1, 1)
@@ -38,56 +226,50 @@ class Grid:
         return self._grid[i]
 
     def get_column(self, i):
-        return [cell[i] for cell in self._grid[i]]
+        return self._grid[:, i]
 
     def get_cell(self, x, y):
-        return self._grid[y][x]
+        return self._grid[y, x]
 
     def set_cell(self, x, y, value):
-        self._grid[y][x] = value
+        self._grid[y, x] = value
 
-    def from_bitmap(self, image):
+    def from_bitmap(self, image, continuous=False):
+        """Cells from an 8 bit image, 0..1 if continuous, else 0 or 1"""
         self.height, self.width = image.shape
-        self._grid = image.clip(0, 1).tolist()
+        if continuous:
+            self._grid = (image / 255).astype(np.float32)
+        else:
+            self._grid = image.clip(0, 1).astype(self.dtype)
 
     def get_neighbours(self, x, y):
-        ns = []
-        for i in (-1, 0, 1):
-            for j in (-1, 0, 1):
-                if not (i == 0 and j == 0):
-                    ns.append(
-                        self.get_cell(
-                            (x + i) % self.width,
-                            (y + j) % self.height,
-                        )
-                    )
-        return ns
-
-    def gol(self, x, y, cell):
-        neighbours = self.get_neighbours(x, y)
-        s = sum(neighbours)
-        if s == 3:
-            return 1
-        elif s == 2:
-            return cell
-        else:
-            return 0
+        ys = [(y + j) % self.height for j in (-1, 0, 1)]
+        xs = [(x + i) % self.width for i in (-1, 0, 1)]
+        return np.delete(self._grid[np.ix_(ys, xs)].ravel(), 4)
+
+    def neighbours(self, kernel=None):
+        """
+        Live neighbour count of every cell, or the sum of the cell values
+        weighted by a Kernel, wrapping around the edges
+        """
+        if kernel is None:
+            return moore(self._grid)[1]
+        return kernel(self._grid)
+
+    def step(self, rules="gol", generations=1):
+        """
+        Advance by generations with a rule string (see make_rule) or a
+        callable mapping the board to the next one
+        """
+        rule = rules if callable(rules) else make_rule(rules)
+        for _ in range(generations):
+            self._grid = rule(self._grid)
 
-    def gul(self, x, y, cell):
-        neighbours = self.get_neighbours(x, y)
-        s = sum(neighbours)
-        if s % 2 == 0:
-            return 0
-        else:
-            return 1
 
-    def step(self, rules="gol"):
-        grid = []
-        for y, row in enumerate(self._grid):
-            grid.append(row.copy())
-            for x, cell in enumerate(row):
-                grid[y][x] = getattr(self, rules)(x, y, cell)
-        self._grid = grid
+def board_digest(board):
+    """Hash of the live cells of a board, for spotting repeats"""
+    packed = np.packbits(board > 0)
+    return hashlib.blake2b(packed, digest_size=16).digest()
 
 
 if __name__ == "__main__":
@@ -109,7 +291,9 @@ if __name__ == "__main__":
         dest="rules",
         action="store",
         default="gol",
-        help="ruleset algorithms\n" + "gol :: conways game of life\n",
+        help="life-like rule as B/S string, e.g. B36/S23, one of "
+        + ", ".join("{0} ({1})".format(*rule) for rule in RULES.items())
+        + ", a larger than life rule like R5,B34..45,S34..58,NC or lenia",
     )
     ap.add_argument(
         "-o",
@@ -140,24 +324,92 @@ if __name__ == "__main__":
     ap.add_argument(
         "-I", "--image", dest="image", action="store", help="init grid from image."
     )
+    ap.add_argument(
+        "-f",
+        "--fps",
+        dest="fps",
+        type=int,
+        action="store",
+        default=25,
+        help="frames per second of the video",
+    )
+    ap.add_argument(
+        "-b",
+        "--backend",
+        dest="backend",
+        action="store",
+        choices=("numpy", "hashlife"),
+        default="numpy",
+        help="hashlife is much faster on sparse boards and long jumps",
+    )
+    ap.add_argument(
+        "--jump",
+        dest="jump",
+        type=int,
+        action="store",
+        default=0,
+        help="render every 2^jump-th generation",
+    )
+    ap.add_argument(
+        "-c",
+        "--on-cycle",
+        dest="on_cycle",
+        action="store",
+        choices=("continue", "stop", "loop"),
+        default="continue",
+        help="when the board repeats: keep stepping, stop, or loop the "
+        "cycle's frames without stepping",
+    )
+    add_sink_arguments(ap)
     args = ap.parse_args()
+    try:
+        rule = make_rule(args.rules)
+    except ValueError as e:
+        ap.error(str(e))
+
+    if args.backend == "hashlife":
+        if not isinstance(rule, LifeRule) or rule.table[0]:
+            ap.error("hashlife runs B/S rules without B0 only")
+        from hashlife import HashGrid as Grid
 
     gol = Grid(width=args.width, height=args.height)
 
     if args.image:
         image = cv2.imread(args.image, cv2.IMREAD_GRAYSCALE)
-        _, image = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
+        if not rule.continuous:
+            _, image = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
         cv2.imshow("image window", image)
         cv2.waitKey(0)
         cv2.destroyAllWindows()
-        gol.from_bitmap(image)
+        gol.from_bitmap(image, continuous=rule.continuous)
     else:
-        gol.randomize()
+        gol.randomize(continuous=rule.continuous)
 
-    print(f"writing {args.iterations} frames to {args.outdir}")
-    for i in range(args.iterations):
-        cv2.imwrite(os.path.join(args.outdir, "{:05d}.png".format(i)), gol.array * 255)
-        gol.step(rules=args.rules)
-        progress(i, args.iterations)
+    print(f"writing {args.iterations} frames to {args.video or args.outdir}")
+    seen = {}
+    with frame_sink(args, (gol.width, gol.height), args.fps) as sink:
+        for i in range(args.iterations):
+            board = gol.array
+            # continuous boards hardly ever repeat exactly
+            key = None if rule.continuous else board_digest(board)
+            if key in seen and args.on_cycle != "continue":
+                first = seen[key]
+                print(f"\nframe {i} repeats frame {first}")
+                if args.on_cycle == "loop":
+                    cycle = [np.packbits(board)]
+                    for _ in range(i - first - 1):
+                        gol.step(rules=args.rules, generations=2**args.jump)
+                        cycle.append(np.packbits(gol.array))
+                    for n in range(i, args.iterations):
+                        packed = cycle[(n - i) % len(cycle)]
+                        frame = np.unpackbits(packed, count=board.size)
+                        sink(n, frame.reshape(board.shape) * 255)
+                        progress(n, args.iterations)
+                break
+            if key is not None:
+                seen[key] = i
+            sink(i, board * 255)
+            gol.step(rules=args.rules, generations=2**args.jump)
+            progress(i, args.iterations)
 
     stdout.write("\n")
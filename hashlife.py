@@ -0,0 +1,294 @@
+import numpy as np
+from grid import Grid, parse_rule
+
+"""
+HashLife: a memoized quadtree engine for life-like rules
+
+Boards are built into canonical (hash-consed) quadtree nodes, so every
+distinct pattern exists once and the future of each node is computed
+once. Empty and repeating regions therefore cost next to nothing, and a
+node can be advanced by 2^j generations in a single step.
+
+The engine works on the infinite plane. A toroidal board is advanced by
+t = 2^j generations by wrapping it t cells on every side, since no
+signal travels further than one cell per generation, and cropping the
+center of the result.
+"""
+
+
+class Node:
+    """
+    Quadtree node of size 2^level. Level 1 nodes are the 2x2 leaves,
+    bits holds the cells of level 1 and 2 nodes, one bit per cell in
+    row-major order.
+    """
+
+    __slots__ = ("nw", "ne", "sw", "se", "level", "population", "bits", "image")
+
+    def __init__(self, nw=None, ne=None, sw=None, se=None, level=1, bits=0):
+        self.nw, self.ne, self.sw, self.se = nw, ne, sw, se
+        self.level = level
+        self.bits = bits
+        self.image = None
+        if level == 1:
+            self.population = bin(bits).count("1")
+        else:
+            self.population = (
+                nw.population + ne.population + sw.population + se.population
+            )
+
+
+def _spread():
+    """Position the bits of a 2x2 leaf in a 4x4 block, per quadrant"""
+    table = np.zeros((4, 16), np.int64)
+    for quadrant in range(4):
+        qy, qx = divmod(quadrant, 2)
+        for code in range(16):
+            for cell in range(4):
+                if code >> cell & 1:
+                    y, x = divmod(cell, 2)
+                    table[quadrant, code] |= 1 << ((2 * qy + y) * 4 + 2 * qx + x)
+    return table.tolist()
+
+
+_SPREAD = _spread()
+
+
+def life_4x4(table):
+    """
+    Center 2x2 of every 4x4 block after one generation, indexed by the
+    16 bits of the block, as 4 bit leaf codes
+    """
+    codes = np.arange(1 << 16)
+    cells = (codes[:, None] >> np.arange(16) & 1).reshape(-1, 4, 4)
+    result = np.zeros(len(codes), np.int64)
+    for bit, (y, x) in enumerate(((1, 1), (1, 2), (2, 1), (2, 2))):
+        window = cells[:, y - 1 : y + 2, x - 1 : x + 2]
+        counts = window.sum(axis=(1, 2)) - cells[:, y, x]
+        result |= table[9 * cells[:, y, x] + counts].astype(np.int64) << bit
+    return result.tolist()
+
+
+class HashLife:
+    """
+    HashLife engine for one life-like rule. Nodes and results are kept
+    between calls until there are more than limit nodes.
+    """
+
+    def __init__(self, rules="gol", limit=4_000_000):
+        table = parse_rule(rules)
+        if table[0]:
+            raise ValueError("HashLife can not run rules with B0")
+        self._table = table
+        self._life = life_4x4(table)
+        self.limit = limit
+        self.clear()
+
+    def clear(self):
+        self._leaves = [Node(bits=bits) for bits in range(16)]
+        self._nodes = {}
+        self._results = {}
+        self._empty = {1: self._leaves[0]}
+
+    def join(self, nw, ne, sw, se):
+        """The canonical node with these quadrants"""
+        key = (nw, ne, sw, se)
+        node = self._nodes.get(key)
+        if node is None:
+            bits = 0
+            if nw.level == 1:
+                bits = (
+                    _SPREAD[0][nw.bits]
+                    | _SPREAD[1][ne.bits]
+                    | _SPREAD[2][sw.bits]
+                    | _SPREAD[3][se.bits]
+                )
+            node = Node(nw, ne, sw, se, nw.level + 1, bits)
+            self._nodes[key] = node
+        return node
+
+    def empty(self, level):
+        if level not in self._empty:
+            e = self.empty(level - 1)
+            self._empty[level] = self.join(e, e, e, e)
+        return self._empty[level]
+
+    def successor(self, node, j):
+        """
+        Center half of node after 2^j generations, j <= node.level - 2
+        """
+        if node.population == 0:
+            return node.nw
+        key = (node, j)
+        result = self._results.get(key)
+        if result is not None:
+            return result
+
+        if node.level == 2:
+            result = self._leaves[self._life[node.bits]]
+        elif node.level == 3 and j == 0:
+            # the quadrants of the leaves are single cells, step the
+            # center 4x4 directly
+            cells = self.image(node)
+            counts = (
+                sum(
+                    cells[2 + dy : 6 + dy, 2 + dx : 6 + dx]
+                    for dy in (-1, 0, 1)
+                    for dx in (-1, 0, 1)
+                )
+                - cells[2:6, 2:6]
+            )
+            center = self._table[9 * cells[2:6, 2:6] + counts]
+            result = self.from_array(center)
+        else:
+            nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+            join, succ = self.join, self.successor
+            c1 = succ(nw, j)
+            c2 = succ(join(nw.ne, ne.nw, nw.se, ne.sw), j)
+            c3 = succ(ne, j)
+            c4 = succ(join(nw.sw, nw.se, sw.nw, sw.ne), j)
+            c5 = succ(join(nw.se, ne.sw, sw.ne, se.nw), j)
+            c6 = succ(join(ne.sw, ne.se, se.nw, se.ne), j)
+            c7 = succ(sw, j)
+            c8 = succ(join(sw.ne, se.nw, sw.se, se.sw), j)
+            c9 = succ(se, j)
+            if j < node.level - 2:
+                # the nine parts are 2^j generations on already, take
+                # their centers
+                result = join(
+                    join(c1.se, c2.sw, c4.ne, c5.nw),
+                    join(c2.se, c3.sw, c5.ne, c6.nw),
+                    join(c4.se, c5.sw, c7.ne, c8.nw),
+                    join(c5.se, c6.sw, c8.ne, c9.nw),
+                )
+            else:
+                result = join(
+                    succ(join(c1, c2, c4, c5), j),
+                    succ(join(c2, c3, c5, c6), j),
+                    succ(join(c4, c5, c7, c8), j),
+                    succ(join(c5, c6, c8, c9), j),
+                )
+        self._results[key] = result
+        return result
+
+    def from_array(self, board):
+        """Node of a square board with a power of two side"""
+        a = (board > 0).astype(np.int64)
+        ids = a[0::2, 0::2] | a[0::2, 1::2] << 1 | a[1::2, 0::2] << 2
+        ids |= a[1::2, 1::2] << 3
+        nodes = self._leaves
+        while ids.shape[0] > 1:
+            # number the distinct quadrant combinations and join each once
+            quads = (ids[0::2, 0::2], ids[0::2, 1::2], ids[1::2, 0::2], ids[1::2, 1::2])
+            n = len(nodes)
+            if n**4 < 1 << 62:
+                keys = ((quads[0] * n + quads[1]) * n + quads[2]) * n + quads[3]
+                if n**4 <= 1 << 20:
+                    counts = np.bincount(keys.ravel(), minlength=n**4)
+                    unique = np.flatnonzero(counts)
+                    lookup = np.zeros(n**4, np.int64)
+                    lookup[unique] = np.arange(len(unique))
+                    ids = lookup[keys]
+                else:
+                    unique, inverse = np.unique(keys, return_inverse=True)
+                    ids = inverse.reshape(keys.shape)
+                nw, rest = np.divmod(unique, n**3)
+                ne, rest = np.divmod(rest, n**2)
+                sw, se = np.divmod(rest, n)
+                rows = zip(nw.tolist(), ne.tolist(), sw.tolist(), se.tolist())
+            else:
+                stacked = np.stack(quads, axis=-1)
+                unique, inverse = np.unique(
+                    stacked.reshape(-1, 4), axis=0, return_inverse=True
+                )
+                ids = inverse.reshape(stacked.shape[:2])
+                rows = unique.tolist()
+            nodes = [
+                self.join(nodes[nw], nodes[ne], nodes[sw], nodes[se])
+                for nw, ne, sw, se in rows
+            ]
+        return nodes[ids[0, 0]]
+
+    def image(self, node):
+        """Cells of a small node, cached on the node"""
+        if node.image is None:
+            if node.level == 1:
+                bits = (node.bits >> np.arange(4)) & 1
+                node.image = bits.astype(np.uint8).reshape(2, 2)
+            else:
+                node.image = np.block(
+                    [
+                        [self.image(node.nw), self.image(node.ne)],
+                        [self.image(node.sw), self.image(node.se)],
+                    ]
+                )
+        return node.image
+
+    def _paint(self, node, out, y, x):
+        if node.population == 0:
+            return
+        if node.level <= 4:
+            size = 1 << node.level
+            out[y : y + size, x : x + size] = self.image(node)
+            return
+        half = 1 << (node.level - 1)
+        self._paint(node.nw, out, y, x)
+        self._paint(node.ne, out, y, x + half)
+        self._paint(node.sw, out, y + half, x)
+        self._paint(node.se, out, y + half, x + half)
+
+    def to_array(self, node):
+        out = np.zeros((1 << node.level, 1 << node.level), np.uint8)
+        self._paint(node, out, 0, 0)
+        return out
+
+    def jump(self, board, j):
+        """Toroidal board after 2^j generations"""
+        t = 1 << j
+        height, width = board.shape
+        side = max(height, width)
+        # the canvas holds the wrapped board, and its center half, which
+        # is what successor returns, holds the board
+        level = max(j + 2, (side + 2 * t + 1).bit_length(), side.bit_length() + 1)
+        size = 1 << level
+        oy, ox = (size - height) // 2, (size - width) // 2
+        canvas = np.zeros((size, size), np.uint8)
+        canvas[oy - t : oy + height + t, ox - t : ox + width + t] = np.pad(
+            board > 0, t, mode="wrap"
+        )
+        result = self.to_array(self.successor(self.from_array(canvas), j))
+        # the result is the center of the canvas, size / 4 in from the edge
+        oy, ox = oy - size // 4, ox - size // 4
+        return result[oy : oy + height, ox : ox + width]
+
+    def advance(self, board, generations):
+        """Toroidal board after any number of generations"""
+        if len(self._nodes) > self.limit:
+            self.clear()
+        # wrapping by more than the board size only adds copies of it
+        longest = max(board.shape).bit_length() - 1
+        j = 0
+        while generations:
+            if j == longest:
+                for _ in range(generations):
+                    board = self.jump(board, j)
+                break
+            if generations & 1:
+                board = self.jump(board, j)
+            generations >>= 1
+            j += 1
+        return board
+
+
+class HashGrid(Grid):
+    """Grid stepping with a HashLife engine per rule"""
+
+    def __init__(self, width=20, height=20):
+        super().__init__(width, height)
+        self._engines = {}
+
+    def step(self, rules="gol", generations=1):
+        if rules not in self._engines:
+            self._engines[rules] = HashLife(rules)
+        board = self._engines[rules].advance(self._grid, generations)
+        self._grid = board.astype(self.dtype)
@@ -0,0 +1,137 @@
+import os
+from collections import OrderedDict
+import numpy as np
+import cv2
+from cachepack import cached
+
+"""
+Decoded input images, shared by the tools that cycle through an image set
+
+Images are decoded (and resized) once and kept in an LRU cache of at most
+VIZZY_IMAGE_CACHE_SIZE bytes (default 512 MiB), keyed on path, size and
+mtime, so an edited file is read again. An image set can also be turned
+into an atlas: one array of all images, stored in the analysis cache and
+memory-mapped on later runs, which skips decoding altogether.
+"""
+
+IMAGE_CACHE_SIZE = int(os.environ.get("VIZZY_IMAGE_CACHE_SIZE", 512 * 1024**2))
+
+
+class ByteCache:
+    """
+    Arrays by key, least recently used first out once they take more than
+    budget bytes. The newest entry is always kept, even over budget.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.nbytes = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    @property
+    def full(self):
+        return self.nbytes >= self.budget
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if key in self._items:
+            self.nbytes -= self._items.pop(key).nbytes
+        self._items[key] = value
+        self.nbytes += value.nbytes
+        while self.nbytes > self.budget and len(self._items) > 1:
+            _, old = self._items.popitem(last=False)
+            self.nbytes -= old.nbytes
+        return value
+
+
+def file_stamp(filename):
+    """What identifies a version of a file: path, size and mtime"""
+    st = os.stat(filename)
+    return (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+
+
+class ImageSource:
+    """
+    The images of files, in order, with image n being files[n % len(files)].
+    size is (width, height) to resize to, flags are cv2.imread flags.
+    """
+
+    def __init__(
+        self,
+        files,
+        size=None,
+        flags=cv2.IMREAD_GRAYSCALE,
+        budget=None,
+        atlas=False,
+    ):
+        self.files = list(files)
+        if not self.files:
+            raise ValueError("no images to read")
+        self.size = None if size is None else tuple(size)
+        self.flags = flags
+        self.budget = IMAGE_CACHE_SIZE if budget is None else budget
+        self.cache = ByteCache(self.budget)
+        self._atlas = self.atlas() if atlas else None
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, n):
+        if self._atlas is not None:
+            return self._atlas[n % len(self.files)]
+        return self.load(self.files[n % len(self.files)])
+
+    def decode(self, filename):
+        image = cv2.imread(filename, self.flags)
+        if image is None:
+            raise OSError("could not read image {0}".format(filename))
+        if self.size is not None and image.shape[1::-1] != self.size:
+            image = cv2.resize(image, self.size)
+        return image
+
+    def load(self, filename):
+        """The decoded image, from the cache if the file did not change"""
+        key = file_stamp(filename)
+        image = self.cache.get(key)
+        if image is None:
+            image = self.cache.put(key, self.decode(filename))
+        return image
+
+    def preload(self):
+        """
+        Decode the images up front, as far as the budget goes. Called
+        before render_frames, the forked workers share them.
+        """
+        if self._atlas is not None:
+            return
+        for filename in self.files:
+            if self.cache.full:
+                break
+            self.load(filename)
+
+    def atlas(self):
+        """
+        All images as one (n, height, width[, channels]) array, cached
+        and memory-mapped. Needs a size, so the images line up.
+        """
+        if self.size is None:
+            raise ValueError("an image atlas needs a size")
+        return cached(
+            "atlas",
+            None,
+            lambda: np.stack([self.decode(f) for f in self.files]),
+            files=[file_stamp(f) for f in self.files],
+            size=self.size,
+            flags=self.flags,
+        )
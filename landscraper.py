@@ -6,14 +6,14 @@ from typing import Any, List, Tuple
 from dataclasses import dataclass
 import sys
 from glob import glob
-from os import path
-from aubio import fft, fvec, level_lin
-from itertools import cycle
+from aubio import fft, fvec
 import argparse
 import cv2
 import numpy as np
 
-from audiopack import loadwav, audio_chunks
+from audiopack import loadwav, count_blocks, get_block
+from imagepack import ImageSource
+from renderpack import render_frames, default_jobs, add_sink_arguments, frame_sink
 
 
 @dataclass
@@ -30,8 +30,6 @@ def scrape(image, image_1, image_2, data: Tuple[List, List], height, width, opt:
     bins1 = f.rdo(f(fvec(d1)))
     bins2 = f.rdo(f(fvec(d2)))
 
-    level = level_lin(fvec(d1 + d2))
-
     if opt.direction == "y":
         source = image_1
         modulator = image_2
@@ -49,10 +47,11 @@ def scrape(image, image_1, image_2, data: Tuple[List, List], height, width, opt:
 
     kernel = kernel / (np.sum(kernel) if np.sum(kernel) != 0 else 1)
 
-    for i, t in enumerate(target):
-        for j, _ in enumerate(t):
-            index = int(j * (opt.amount * modulator[i][j]) / 255) % dim
-            target[i][j] += source[i][index]
+    # every pixel j of a line samples the source line at j scaled by the
+    # modulator, wrapped around the line
+    j = np.arange(target.shape[1])
+    index = np.trunc(j * (opt.amount * modulator) / 255).astype(int) % dim
+    target += np.take_along_axis(source, index, axis=1)
 
     img_blurred = cv2.GaussianBlur(cv2.filter2D(image, -1, kernel), glow, 1)
 
@@ -114,37 +113,56 @@ if __name__ == "__main__":
     parser.add_argument(
         "-f", "--fps", type=int, action="store", default=25, help="frames per second"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        action="store",
+        default=default_jobs(),
+        help="number of frames to render in parallel",
+    )
+    parser.add_argument(
+        "--atlas",
+        action="store_true",
+        help="keep the decoded images in the analysis cache for the next run",
+    )
+    add_sink_arguments(parser)
     args = parser.parse_args()
 
-    meta, data = loadwav(args.soundfile)
-
-    data = data * args.amplify
+    meta, data = loadwav(args.soundfile, mmap=True)
 
     blocksize: int = meta.rate // args.fps
     blocks: int = meta.samples // blocksize
 
-    image_set_1 = glob(args.images[0])
-    image_set_2 = glob(args.images[1])
+    size = (args.width, args.height)
+    # scrape at the output size
+    image_set_1 = ImageSource(glob(args.images[0]), size, atlas=args.atlas)
+    image_set_2 = ImageSource(glob(args.images[1]), size, atlas=args.atlas)
+    image_set_1.preload()
+    image_set_2.preload()
 
     opt = Opt(direction=args.direction, amount=args.amount)
 
-    for n, (block, image_1, image_2) in enumerate(
-        zip(audio_chunks(data, blocksize), cycle(image_set_1), cycle(image_set_2))
-    ):
-        padded = "{0:05d}".format(n)
-        bitmap_1 = cv2.imread(image_1, cv2.IMREAD_GRAYSCALE)
-        bitmap_2 = cv2.imread(image_2, cv2.IMREAD_GRAYSCALE)
-        height, width = bitmap_1.shape
+    def render(n, frame):
+        block = get_block(data, n, blocksize) * args.amplify
+        bitmap_1 = image_set_1[n]
+        bitmap_2 = image_set_2[n]
+        height, width = args.height, args.width
         bitmap = np.zeros((height, width), np.uint8)
 
         if meta.channels == 2:
             block_channels = (block.T[0], block.T[1])
         else:
-            block_channels = np.array_split(data, 2)
-
-        image = scrape(bitmap, bitmap_1, bitmap_2, block_channels, height, width, opt)
-        cv2.resize(image, (args.width, args.height))
-        cv2.imwrite(path.join(args.outdir, f"{padded}.png"), image)
-
-        percent_finished = int(n / blocks * 100)
-        print(f"{percent_finished:>3}%", end="\r", flush=True)
+            block_channels = np.array_split(block, 2)
+
+        return scrape(bitmap, bitmap_1, bitmap_2, block_channels, height, width, opt)
+
+    sink = frame_sink(args, size, args.fps, audio=args.soundfile)
+    with sink:
+        render_frames(
+            render,
+            count_blocks(data, blocksize),
+            shape=(args.height, args.width),
+            write=sink,
+            jobs=args.jobs,
+        )
@@ -3,17 +3,11 @@ from __future__ import print_function, division
 import os.path
 from sys import stdout
 import argparse
-import numpy as np
-import scipy.fftpack
 from drawSvg import Drawing
-from audiopack import loadwav, audio_chunks
-from videopack import render_frame
-from lib import progress
-
-
-def spectrum(block):
-    s = scipy.fftpack.fft(block)
-    return 2.0 / N * np.abs(s[: N // 2])
+from audiopack import loadwav, stft, band_map, LAYOUTS
+from cachepack import cached
+from videopack import render_frame, add_output_arguments, is_raster, output_opts
+from renderpack import render_frames, default_jobs, frame_sink
 
 
 if __name__ == "__main__":
@@ -61,9 +55,37 @@ if __name__ == "__main__":
         default=720,
         help="height",
     )
+    parser.add_argument(
+        "-b",
+        "--bands",
+        dest="bands",
+        type=int,
+        action="store",
+        default=0,
+        help="sum the spectrum into this many bands. 0 keeps all fft bins",
+    )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        dest="layout",
+        action="store",
+        choices=LAYOUTS,
+        default="linear",
+        help="frequency band layout",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        action="store",
+        default=default_jobs(),
+        help="number of frames to render in parallel",
+    )
+    add_output_arguments(parser)
     args = parser.parse_args()
 
-    meta, data = loadwav(args.soundfile)
+    meta, data = loadwav(args.soundfile, mmap=True)
 
     print("Samplerate: %d" % meta.rate)
     print("Channels: %d" % meta.channels)
@@ -74,32 +96,54 @@ if __name__ == "__main__":
 
     print("%d Frames at %d samples" % (blocks, blocksize))
 
-    N = blocksize
-    T = 1.0 / blocksize * 1.25
-    for n, b in enumerate(audio_chunks(data, blocksize)):
+    spec = cached(
+        "stft", args.soundfile, lambda: stft(data, blocksize), blocksize=blocksize
+    )
+    if args.bands:
+        spec = band_map(meta.rate, blocksize, args.bands, args.layout)(spec)
+
+    opts = output_opts(args)
+
+    def render(n, frame=None):
         padded = "{0:03d}".format(n)
-        drawing = Drawing(args.width, args.height, origin=(0, 0))
+        if frame is None:
+            drawing = Drawing(args.width, args.height, origin=(0, 0))
+        else:
+            drawing = frame
         if args.multichannel and meta.channels > 1:
-            reflect = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
             for i in range(meta.channels - 1):
                 scene = render_frame(
                     drawing,
-                    spectrum(b.T[i]),
+                    spec[i, n],
                     plotter="osci",
                     width=args.width,
                     height=args.height,
+                    opts=opts,
                 )
         else:
-            if meta.channels > 1:
-                b = b.T[0]
             scene = render_frame(
                 drawing,
-                spectrum(b),
+                spec[0, n],
                 plotter="osci",
                 width=args.width,
                 height=args.height,
+                opts=opts,
+            )
+        if frame is None:
+            drawing.saveSvg(os.path.join(args.outdir, "spectrum_" + padded + ".svg"))
+
+    if is_raster(args):
+        size = (args.width, args.height)
+        name = "spectrum_{0:03d}"
+        with frame_sink(args, size, args.fps, audio=args.soundfile, name=name) as sink:
+            render_frames(
+                render,
+                spec.shape[1],
+                shape=(args.height, args.width),
+                write=sink,
+                jobs=args.jobs,
             )
-        drawing.saveSvg(os.path.join(args.outdir, "spectrum_" + padded + ".svg"))
-        progress(n, blocks)
+    else:
+        render_frames(render, spec.shape[1], jobs=args.jobs)
 
     stdout.write("\n")
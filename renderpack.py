@@ -0,0 +1,281 @@
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import cv2
+from lib import progress
+
+"""
+Render frames in parallel and hand them on in order
+"""
+
+# the job of the current render_frames call, inherited by the forked workers
+_job = None
+
+
+class _Job:
+    def __init__(self, render, frames):
+        self.render = render
+        self.frames = frames
+
+
+def _draw(render, n, frame):
+    if frame is None:
+        render(n)
+        return
+    frame[...] = 0
+    result = render(n, frame)
+    if result is not None and result is not frame:
+        frame[...] = result
+
+
+def _render_slot(n, slot):
+    frame = None if _job.frames is None else _job.frames[slot]
+    _draw(_job.render, n, frame)
+    return n
+
+
+def to_uint8(frame):
+    """Saturate a frame to 8 bit, the way cv2.imwrite does"""
+    if frame.dtype == np.uint8:
+        return frame
+    return np.clip(np.rint(frame), 0, 255).astype(np.uint8)
+
+
+FORMATS = ("png", "ppm", "bmp", "tiff")
+
+
+def image_params(fmt, compression=None):
+    """cv2.imwrite flags for fmt, compression is 0-9 with 0 uncompressed"""
+    if compression is None:
+        return []
+    if fmt == "png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, compression]
+    if fmt == "tiff":
+        # 1 is no compression, 5 is LZW
+        return [cv2.IMWRITE_TIFF_COMPRESSION, 5 if compression else 1]
+    return []
+
+
+class ImageSink:
+    """
+    Write frames to outdir as numbered image files. Encoding happens on a
+    pool of writer threads (cv2 releases the GIL), at most `queue` frames
+    are copied and in flight at a time.
+    """
+
+    def __init__(
+        self,
+        outdir,
+        name="{0:05d}",
+        offset=0,
+        ext="png",
+        compression=None,
+        writers=None,
+        queue=None,
+    ):
+        self.outdir = outdir
+        self.name = name
+        self.offset = offset
+        self.ext = ext
+        self.params = image_params(ext, compression)
+        writers = writers or min(4, default_jobs())
+        self._pool = ThreadPoolExecutor(writers)
+        self._pending = deque()
+        self._queue = queue or 2 * writers
+
+    def _write(self, filename, frame):
+        if not cv2.imwrite(filename, frame, self.params):
+            raise OSError("could not write {0}".format(filename))
+
+    def __call__(self, n, frame):
+        while len(self._pending) >= self._queue:
+            self._pending.popleft().result()
+        filename = self.name.format(n + self.offset) + "." + self.ext
+        # the render buffers get reused, the writer needs its own copy
+        image = to_uint8(frame)
+        if self.ext == "ppm" and image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif image is frame:
+            image = frame.copy()
+        self._pending.append(
+            self._pool.submit(self._write, os.path.join(self.outdir, filename), image)
+        )
+
+    def close(self):
+        try:
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class VideoSink:
+    """
+    Pipe frames straight into an ffmpeg encoder, optionally muxing in the
+    soundtrack. Frames must be BGR or grayscale and all of the same size.
+    """
+
+    def __init__(self, filename, size, fps, codec="libx264", crf=18, audio=None):
+        import imageio_ffmpeg
+
+        self._writer = imageio_ffmpeg.write_frames(
+            filename,
+            size,
+            pix_fmt_in="bgr24",
+            fps=fps,
+            codec=codec,
+            quality=None,
+            macro_block_size=2,
+            output_params=["-crf", str(crf)],
+            audio_path=audio,
+            audio_codec=audio and "aac",
+        )
+        self._writer.send(None)
+
+    def __call__(self, n, frame):
+        frame = to_uint8(frame)
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        self._writer.send(np.ascontiguousarray(frame))
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def add_sink_arguments(parser):
+    """Options for frame_sink"""
+    parser.add_argument(
+        "--video",
+        dest="video",
+        action="store",
+        help="encode the frames into this video file instead of writing images",
+    )
+    parser.add_argument(
+        "--codec",
+        dest="codec",
+        action="store",
+        default="libx264",
+        help="ffmpeg video codec",
+    )
+    parser.add_argument(
+        "--crf",
+        dest="crf",
+        type=int,
+        action="store",
+        default=18,
+        help="constant rate factor, lower is better quality",
+    )
+    parser.add_argument(
+        "--format",
+        dest="format",
+        action="store",
+        choices=FORMATS,
+        default="png",
+        help="image format, ppm and bmp are uncompressed and fastest to write",
+    )
+    parser.add_argument(
+        "--compression",
+        dest="compression",
+        type=int,
+        action="store",
+        choices=range(10),
+        metavar="0-9",
+        help="png compression level, or any non-zero level for LZW tiff",
+    )
+
+
+def frame_sink(args, size, fps, audio=None, name="{0:05d}", offset=0):
+    """The sink selected by the add_sink_arguments options"""
+    if args.video:
+        return VideoSink(
+            args.video, size, fps, codec=args.codec, crf=args.crf, audio=audio
+        )
+    return ImageSink(
+        args.outdir,
+        name=name,
+        offset=offset,
+        ext=args.format,
+        compression=args.compression,
+    )
+
+
+def default_jobs():
+    return os.cpu_count() or 1
+
+
+def render_frames(
+    render, count, shape=None, dtype=np.uint8, write=None, jobs=None, start=0
+):
+    """
+    Render frames start..count-1 on a pool of jobs worker processes.
+
+    With a shape, render(n, frame) draws into a zeroed frame buffer (or
+    returns an image to copy into it) and write(n, frame) receives the
+    frames in order. The buffers live in shared memory, so only frame
+    numbers are sent between processes. Without a shape, render(n) is
+    expected to write its own output.
+
+    Workers are forked, so they see the loaded audio and any analysis
+    results (memory-mapped or copy-on-write) without pickling them.
+    """
+    global _job
+
+    jobs = jobs or default_jobs()
+    total = count - start
+    if jobs == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        frame = None if shape is None else np.zeros(shape, dtype)
+        for n in range(start, count):
+            _draw(render, n, frame)
+            if write is not None and frame is not None:
+                write(n, frame)
+            progress(n - start, total)
+        return
+
+    slots = 2 * jobs
+    shm = None
+    frames = None
+    if shape is not None:
+        nbytes = slots * int(np.prod(shape)) * np.dtype(dtype).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+        frames = np.ndarray((slots,) + tuple(shape), dtype, buffer=shm.buf)
+
+    _job = _Job(render, frames)
+    try:
+        with multiprocessing.get_context("fork").Pool(jobs) as pool:
+            pending = deque()
+
+            def flush():
+                n, slot, result = pending.popleft()
+                result.get()
+                if write is not None and frames is not None:
+                    write(n, frames[slot])
+                progress(n - start, total)
+
+            for n in range(start, count):
+                if len(pending) == slots:
+                    flush()
+                slot = n % slots
+                pending.append((n, slot, pool.apply_async(_render_slot, (n, slot))))
+            while pending:
+                flush()
+    finally:
+        _job = None
+        if shm is not None:
+            del frames
+            shm.close()
+            shm.unlink()
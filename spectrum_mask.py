@@ -1,43 +1,66 @@
 #!/usr/bin/env python3
 import sys
-import os.path
 import argparse
+from functools import lru_cache
 import numpy as np
-import cv2
-from audiopack import loadwav, audio_chunks, spectrum, rms
-from lib import progress
+from audiopack import loadwav, get_block, stft, band_map, rms, LAYOUTS
+from cachepack import cached
+from renderpack import render_frames, default_jobs, add_sink_arguments, frame_sink
 
 
-def gray_frame(img, spectrum, spread, blocksize, height):
-    for n, f in enumerate(spectrum):
-        c = np.uint8(f * spread * 255)
-        yoff = int(height / 2 * n / blocksize)
-        if n % 2 == 0:
-            yoff = -yoff
-        row = int(height / 2) + yoff
-        img[row] += (c, c, c)
+@lru_cache(maxsize=64)
+def gray_rows(height, blocksize):
+    """Row of every bin in gray_frame, odd bins below the middle"""
+    n = np.arange(blocksize)
+    yoff = (height / 2 * n / blocksize).astype(int)
+    yoff[0::2] *= -1
+    return int(height / 2) + yoff
+
+
+@lru_cache(maxsize=64)
+def bar_rows(height, blocksize, spread):
+    """Center row of every bin's bar and 1 / n, which widens the low bars"""
+    n = np.arange(blocksize)
+    yoff = (height / 2 * n / blocksize * spread / 2.0).astype(int)
+    yoff[0::2] *= -1
+    inverse = np.zeros(blocksize)
+    inverse[1:] = 1 / n[1:]
+    return height // 2 - yoff, inverse
+
+
+def add_rows(img, rows):
+    """Add a value per row to img, saturating at white"""
+    touched = np.flatnonzero(rows)
+    shape = (-1,) + (1,) * (img.ndim - 1)
+    levels = np.minimum(rows[touched], 255).astype(np.uint8).reshape(shape)
+    current = img[touched]
+    img[touched] = current + np.minimum(levels, 255 - current)
     return img
 
 
+def gray_frame(img, spectrum, spread, blocksize, height):
+    """Add every bin as a gray line, brighter the stronger it is"""
+    levels = np.clip(np.trunc(spectrum * spread * 255), 0, 255)
+    rows = np.bincount(gray_rows(height, blocksize), levels, minlength=height)
+    return add_rows(img, rows[:height])
+
+
 def render_frame(img, spectrum, threshold, thickness, spread, width, height):
     blocksize = len(spectrum)
     if threshold == 0:
         return gray_frame(img, spectrum, spread, blocksize, height)
 
-    for n, f in enumerate(spectrum):
-        if np.abs(f) > threshold:
-            try:
-                barsize = thickness * (f * spread + 1 / n) ** 2
-            except ZeroDivisionError:
-                barsize = 0
-
-            yoff = int(height / 2 * n / blocksize * spread / 2.0)
-            if n % 2 == 0:
-                yoff = -yoff
-            p1 = (0, height // 2 - yoff - int(barsize))
-            p2 = (width, height // 2 - yoff + int(barsize))
-            cv2.rectangle(img, p1, p2, (255, 255, 255), cv2.FILLED)
-
+    centers, inverse = bar_rows(height, blocksize, spread)
+    active = np.abs(spectrum) > threshold
+    barsize = (thickness * (spectrum * spread + inverse) ** 2)[active].astype(int)
+    barsize[np.flatnonzero(active) == 0] = 0
+    top = np.clip(centers[active] - barsize, 0, height)
+    bottom = np.clip(centers[active] + barsize + 1, 0, height)
+    # count the bars over every row with a difference array
+    cover = np.zeros(height + 1, int)
+    np.add.at(cover, top, 1)
+    np.add.at(cover, bottom, -1)
+    img[np.cumsum(cover[:height]) > 0] = 255
     return img
 
 
@@ -116,9 +139,37 @@ if __name__ == "__main__":
         default=1.0,
         help="spread. if set to zero will try and follow block energy",
     )
+    parser.add_argument(
+        "-b",
+        "--bands",
+        dest="bands",
+        type=int,
+        action="store",
+        default=0,
+        help="sum the spectrum into this many bands. 0 keeps all fft bins",
+    )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        dest="layout",
+        action="store",
+        choices=LAYOUTS,
+        default="linear",
+        help="frequency band layout",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        action="store",
+        default=default_jobs(),
+        help="number of frames to render in parallel",
+    )
+    add_sink_arguments(parser)
     args = parser.parse_args()
 
-    meta, data = loadwav(args.soundfile)
+    meta, data = loadwav(args.soundfile, mmap=True)
 
     print("Samplerate: %d" % meta.rate)
     print("Channels: %d" % meta.channels)
@@ -130,16 +181,20 @@ if __name__ == "__main__":
     print("%d Frames at %d samples" % (blocks, blocksize))
     term_width = 100
 
-    N = blocksize
-    T = 1.0 / blocksize * 1.25
-    for n, b in enumerate(audio_chunks(data, blocksize)):
-        img = np.zeros((args.height, args.width, 3), np.uint8)
+    # magnitudes, blocksize // 2 + 1 bins per frame, which set the bar layout
+    spec = cached(
+        "stft", args.soundfile, lambda: stft(data, blocksize), blocksize=blocksize
+    )
+    if args.bands:
+        spec = band_map(meta.rate, blocksize, args.bands, args.layout)(spec)
+
+    def render(n, img):
+        b = get_block(data, n, blocksize)
         if args.multichannel and meta.channels > 1:
-            reflect = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
             for i in range(meta.channels - 1):
                 img = render_frame(
                     img,
-                    spectrum(b.T[i], N),
+                    spec[i, n],
                     threshold=args.threshold,
                     thickness=args.thickness,
                     spread=args.spread or rms(b.T[i]) * 4,
@@ -151,14 +206,26 @@ if __name__ == "__main__":
                 b = b.T[0]
             img = render_frame(
                 img,
-                spectrum(b, N),
+                spec[0, n],
                 threshold=args.threshold,
                 thickness=args.thickness,
                 spread=args.spread or rms(b) * 4,
                 width=args.width,
                 height=args.height,
             )
-        cv2.imwrite(os.path.join(args.outdir, "{0:05d}.png".format(n + 1)), img)
-        progress(n, blocks)
+        return img
+
+    sink = frame_sink(
+        args, (args.width, args.height), args.fps, audio=args.soundfile, offset=1
+    )
+    with sink:
+        render_frames(
+            render,
+            spec.shape[1],
+            # only white and gray, so one channel does
+            shape=(args.height, args.width),
+            write=sink,
+            jobs=args.jobs,
+        )
 
     sys.stdout.write("\n")
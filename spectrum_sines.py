@@ -1,30 +1,35 @@
 #!/usr/bin/env python3
 import sys
-import os.path
 import argparse
 import numpy as np
-import scipy.fftpack
 import cv2
-from audiopack import loadwav, audio_chunks
-from lib import progress
+from audiopack import loadwav, stft, band_map, LAYOUTS
+from cachepack import cached
+from renderpack import render_frames, default_jobs, add_sink_arguments, frame_sink
 
 
-def spectrum(block, N):
-    s = scipy.fftpack.fft(block)
-    return 2.0 / N * np.abs(s[: N // 2])
+def sine_curves(spectrum, threshold, width, height):
+    """
+    One polyline per bin above threshold: a sine of the bin's frequency
+    across the width, scaled by its magnitude and flipped for even bins
+    """
+    bins = np.flatnonzero(np.abs(spectrum) > threshold)
+    x = np.arange(width - 1)
+    y = spectrum[bins, None] * np.sin(bins[:, None] * (x / width))
+    y[bins % 2 == 0] *= -1.0
+    curves = np.empty((len(bins), width, 2), np.int32)
+    curves[:, 0] = 0, height // 2
+    curves[:, 1:, 0] = x + 1
+    # int() rounds towards zero, keep clear of int32 overflow
+    curves[:, 1:, 1] = np.clip(y * height + height / 2, -(1 << 30), 1 << 30)
+    return curves
 
 
 def render_frame(img, spectrum, threshold, width, height):
-    for n, f in enumerate(spectrum):
-        if np.abs(f) > threshold:
-            p1 = (0, height // 2)
-            for x in range(width - 1):
-                y = f * np.sin(float(n) * (float(x) / float(width)))
-                if n % 2 == 0:
-                    y *= -1.0
-                p2 = (x + 1, int(y * height + height / 2))
-                cv2.line(img, p1, p2, (255, 255, 255), lineType=cv2.LINE_AA)
-                p1 = p2
+    curves = sine_curves(spectrum, threshold, width, height)
+    if len(curves):
+        color = 255 if img.ndim == 2 else (255,) * img.shape[2]
+        cv2.polylines(img, list(curves), False, color, lineType=cv2.LINE_AA)
     return img
 
 
@@ -82,9 +87,37 @@ if __name__ == "__main__":
         default=0.1,
         help="threshold",
     )
+    parser.add_argument(
+        "-b",
+        "--bands",
+        dest="bands",
+        type=int,
+        action="store",
+        default=0,
+        help="sum the spectrum into this many bands. 0 keeps all fft bins",
+    )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        dest="layout",
+        action="store",
+        choices=LAYOUTS,
+        default="linear",
+        help="frequency band layout",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        action="store",
+        default=default_jobs(),
+        help="number of frames to render in parallel",
+    )
+    add_sink_arguments(parser)
     args = parser.parse_args()
 
-    meta, data = loadwav(args.soundfile)
+    meta, data = loadwav(args.soundfile, mmap=True)
 
     print("Samplerate: %d" % meta.rate)
     print("Channels: %d" % meta.channels)
@@ -95,31 +128,44 @@ if __name__ == "__main__":
 
     print("%d Frames at %d samples" % (blocks, blocksize))
 
-    N = blocksize
-    for n, b in enumerate(audio_chunks(data, blocksize)):
-        padded = "{0:05d}".format(n + 1)
-        img = np.zeros((args.height, args.width, 3), np.uint8)
+    spec = cached(
+        "stft", args.soundfile, lambda: stft(data, blocksize), blocksize=blocksize
+    )
+    if args.bands:
+        spec = band_map(meta.rate, blocksize, args.bands, args.layout)(spec)
+
+    def render(n, img):
         if args.multichannel and meta.channels > 1:
-            reflect = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
             for i in range(meta.channels - 1):
                 img = render_frame(
                     img,
-                    spectrum(b.T[i], N),
+                    spec[i, n],
                     threshold=args.threshold,
                     width=args.width,
                     height=args.height,
                 )
         else:
-            if meta.channels > 1:
-                b = b.T[0]
             img = render_frame(
                 img,
-                spectrum(b, N),
+                spec[0, n],
                 threshold=args.threshold,
                 width=args.width,
                 height=args.height,
             )
-        cv2.imwrite(os.path.join(args.outdir, "%s.png" % padded), img)
-        progress(n, blocks)
+        return img
+
+    sink = frame_sink(
+        args, (args.width, args.height), args.fps, audio=args.soundfile, offset=1
+    )
+    with sink:
+        render_frames(
+            render,
+            spec.shape[1],
+            # white on black, so one channel does, and antialiases in half
+            # the time
+            shape=(args.height, args.width),
+            write=sink,
+            jobs=args.jobs,
+        )
 
     sys.stdout.write("\n")
@@ -0,0 +1,113 @@
+import numpy as np
+from drawSvg import Path
+
+"""
+Build svg paths from coordinate arrays in one go, optionally reducing the
+points to what can be seen at the output resolution first
+"""
+
+
+def path_data(xy, close=False, precision=2):
+    """
+    Path data for a line through the (n, 2) points xy, formatted with a
+    fixed number of decimals. y is negated, like the drawSvg Path
+    commands do.
+    """
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2) * (1.0, -1.0)
+    # one template for the whole path, formatted in a single call
+    pair = "%%.%df,%%.%df" % (precision, precision)
+    d = "M" + " L".join([pair] * len(xy)) % tuple(xy.ravel().tolist())
+    if close:
+        d += " Z"
+    return d
+
+
+def polyline(xy, close=False, precision=2, **kwargs):
+    """drawSvg Path through xy, keyword arguments are svg properties"""
+    return Path(d=path_data(xy, close, precision), **kwargs)
+
+
+def _first_where(mask, starts, n):
+    """Index of the first True of every segment beginning at starts, or n"""
+    return np.minimum.reduceat(np.where(mask, np.arange(n), n), starts)
+
+
+def minmax(xy):
+    """
+    Keep the lowest and the highest point of every pixel column, and the
+    end points, in path order. x must be ascending, like the samples of a
+    waveform.
+    """
+    xy = np.asarray(xy, dtype=float)
+    n = len(xy)
+    if n < 3:
+        return xy
+    column = np.floor(xy[:, 0])
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(column)) + 1))
+    counts = np.diff(np.append(starts, n))
+    y = xy[:, 1]
+    low = np.repeat(np.minimum.reduceat(y, starts), counts)
+    high = np.repeat(np.maximum.reduceat(y, starts), counts)
+    picks = np.concatenate(
+        (
+            [0, n - 1],
+            _first_where(y == low, starts, n),
+            _first_where(y == high, starts, n),
+        )
+    )
+    return xy[np.unique(picks)]
+
+
+def rdp(xy, tolerance=0.5):
+    """
+    Ramer-Douglas-Peucker simplification: drop every point that is closer
+    than tolerance to the line between the points kept around it. All
+    open segments are split at once, so it takes one pass per level, and
+    the points of finished segments drop out.
+    """
+    xy = np.asarray(xy, dtype=float)
+    n = len(xy)
+    if n < 3:
+        return xy
+    keep = np.zeros(n, bool)
+    keep[[0, -1]] = True
+    active = np.arange(1, n - 1)
+    while len(active):
+        kept = np.flatnonzero(keep)
+        segment = np.searchsorted(kept, active)
+        a = xy[kept[segment - 1]]
+        ab = xy[kept[segment]] - a
+        ap = xy[active] - a
+        chord = np.hypot(ab[:, 0], ab[:, 1])
+        cross = np.abs(ab[:, 0] * ap[:, 1] - ab[:, 1] * ap[:, 0])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distance = np.where(chord > 0, cross / chord, np.hypot(ap[:, 0], ap[:, 1]))
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(segment)) + 1))
+        counts = np.diff(np.append(starts, len(active)))
+        furthest = np.maximum.reduceat(distance, starts)
+        split = _first_where(
+            distance == np.repeat(furthest, counts), starts, len(active)
+        )
+        split = split[furthest > tolerance]
+        keep[active[split]] = True
+        # segments that were not split are done
+        still_open = np.repeat(furthest > tolerance, counts)
+        active = active[still_open & ~keep[active]]
+    return xy[keep]
+
+
+def simplify(xy, decimate=None, tolerance=0.5):
+    """
+    Reduce points with decimate "minmax", "rdp" or both ("minmax+rdp"),
+    None keeps them all
+    """
+    if decimate is None:
+        return xy
+    for method in decimate.split("+"):
+        if method == "minmax":
+            xy = minmax(xy)
+        elif method == "rdp":
+            xy = rdp(xy, tolerance)
+        else:
+            raise ValueError("unknown decimation {0!r}".format(method))
+    return xy
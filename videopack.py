@@ -1,8 +1,10 @@
-from drawSvg import Path
 from math import pi, e
-import random
+import numpy as np
+import cv2
 from audiopack import spectrum, rms
-from flash import Flash, Point
+from flash import Point, lightning
+from renderpack import add_sink_arguments
+from svgpack import polyline, rdp
 
 
 ##     ##     ##      ##     ##     ##     ##     ##     ##
@@ -12,85 +14,115 @@ from flash import Flash, Point
 ### Data visualization functions
 ##
 #
+# fixed point bits for sub-pixel raster coordinates
+SHIFT = 4
+
+
+def raster_points(xy, height):
+    """
+    Points in drawSvg coordinates (y up) as fixed point pixel coordinates
+    for cv2, clipped far enough out to stay clear of int32 overflow
+    """
+    pixels = np.column_stack((xy[:, 0], height - xy[:, 1]))
+    pixels = np.clip(pixels * (1 << SHIFT), -(1 << 30), 1 << 30)
+    return np.rint(pixels).astype(np.int32)
+
+
+def draw_path(drawing, xy, fill=False, opts=None):
+    """
+    Draw a line through the (n, 2) points xy, either as an svg Path on a
+    Drawing or anti-aliased into a raster frame, white on black. Filled
+    paths are closed. opts may set the svg "precision" in decimals and a
+    "tolerance" in pixels to simplify the line by.
+    """
+    opts = opts or {}
+    if opts.get("tolerance"):
+        xy = rdp(xy, opts["tolerance"])
+    if isinstance(drawing, np.ndarray):
+        color = opts.get("color", 255)
+        if drawing.ndim == 3:
+            color = (color,) * drawing.shape[2]
+        points = [raster_points(xy, drawing.shape[0])]
+        if fill:
+            cv2.fillPoly(drawing, points, color, cv2.LINE_AA, SHIFT)
+        cv2.polylines(drawing, points, fill, color, 1, cv2.LINE_AA, SHIFT)
+        return drawing
+
+    path = polyline(
+        xy,
+        close=fill,
+        precision=opts.get("precision", 2),
+        stroke_width=1,
+        stroke="black",
+        fill="black",
+        fill_opacity=float(fill),
+    )
+    drawing.append(path)
+    return drawing
+
+
 def scatter(drawing, data, width, height, reflect, opts=None):
     """plot pairs of samples as coordinates"""
-    path = Path(stroke_width=1, stroke="black", fill="black", fill_opacity=0.0)
     cx, cy = (width * 0.5, height * 0.5)
-    path.M(cx, cy)
-    for i in range(len(data) // 2):
-        px = data[i * 2 : i * 2 + 2][0]
-        py = data[i * 2 : i * 2 + 2][1]
-        path.L(cx + width * px * 0.5 * reflect[0], cy + height * py * 0.5 * reflect[1])
-
-    drawing.append(path)
-    return drawing
+    pairs = len(data) // 2
+    xy = np.empty((pairs + 1, 2))
+    xy[0] = cx, cy
+    xy[1:, 0] = cx + width * data[0 : 2 * pairs : 2] * 0.5 * reflect[0]
+    xy[1:, 1] = cy + height * data[1 : 2 * pairs : 2] * 0.5 * reflect[1]
+    return draw_path(drawing, xy, opts=opts)
 
 
 def osci(drawing, data, width, height, reflect, opts=None):
     """Draw a path from left to right, sample on y"""
-    path = Path(stroke_width=1, stroke="black", fill="black", fill_opacity=0.0)
-    path.M(0.0, height * 0.5)
     points = len(data)
-    for i in range(points):
-        x = i * width / points
-        y = height * data[i] + height * 0.5
-        path.L(x, y)
-
-    drawing.append(path)
-    return drawing
+    xy = np.empty((points + 1, 2))
+    xy[0] = 0.0, height * 0.5
+    xy[1:, 0] = np.arange(points) * width / points
+    xy[1:, 1] = height * data[:points] + height * 0.5
+    return draw_path(drawing, xy, opts=opts)
 
 
 def cross(drawing, data, width, height, reflect, opts=None):
-    path = Path(stroke_width=1, stroke="black", fill="black", fill_opacity=0.0)
-    path.M(width * 0.5, height * 0.5)
     spec = spectrum(data, len(data))
-    for i, j in zip(data, spec):
-        x = i * width * 0.5 + width * 0.5
-        y = (height * j * 0.5 * pi) + height * 0.5
-        # y  = height * j * pi
-        path.L(x, y)
-
-    drawing.append(path)
-    return drawing
+    points = min(len(data), len(spec))
+    xy = np.empty((points + 1, 2))
+    xy[0] = width * 0.5, height * 0.5
+    xy[1:, 0] = data[:points] * width * 0.5 + width * 0.5
+    # y  = height * j * pi
+    xy[1:, 1] = (height * spec[:points] * 0.5 * pi) + height * 0.5
+    return draw_path(drawing, xy, opts=opts)
 
 
 def flash(drawing, data, width, height, reflect, opts=None):
     opts = opts or {}
+    rng = opts.get("rng") or np.random.default_rng()
     use_spec = opts.get("use-spec")
     half_width = width / 2
-    flash = Flash(width=width, height=height)
-    first_flash = flash
-    flashes = [flash]
     nodes = len(data) // 2
     energy = rms(data)
     if use_spec:
         spec = spectrum(data, nodes)
         idxs = (-spec).argsort()[:nodes]
-        j = 0
-
-    for i in range(nodes):
-        if flash.current_point().within_perimeter(flash.end, height / 20):
-            start = first_flash.random_node
-            end_x = half_width + random.randint(-1, 1) * (half_width - energy)
-            end = (
-                Point(end_x, (height / nodes) * idxs[j])
-                if use_spec
-                else Point(end_x, random.randint(0, height))
-            )
-            flash = Flash(width=width, height=height, start=start, end=end)
-            flashes.append(flash)
-            if use_spec:
-                j += 1
-        else:
-            if opts.get("long-legs"):
-                factor = random.randrange(1, max(3, int(7 + energy))) ** e
-            else:
-                factor = random.randrange(1, max(3, int(15 + energy)))
 
-            flash.random_walk(data[i] * factor, data[nodes - i - 1], mix=0.0)
-
-    for flash in flashes:
-        drawing = flash.render(drawing, opts.get("thickness"))
+    def end(rng, branch):
+        end_x = half_width + rng.integers(-1, 2) * (half_width - energy)
+        if use_spec:
+            return Point(end_x, (height / nodes) * idxs[branch])
+        return Point(end_x, rng.integers(0, height + 1))
+
+    if opts.get("long-legs"):
+        factor = rng.integers(1, max(3, int(7 + energy)), nodes) ** e
+    else:
+        factor = rng.integers(1, max(3, int(15 + energy)), nodes)
+
+    for flash in lightning(width, height, data[:nodes] * factor, rng, end=end):
+        if isinstance(drawing, np.ndarray):
+            outline = flash.outline(opts.get("thickness"))
+            drawing = draw_path(drawing, outline, fill=True, opts=opts)
+        else:
+            drawing = flash.render(
+                drawing, opts.get("thickness"), opts.get("precision", 2)
+            )
 
     return drawing
 
@@ -98,10 +130,52 @@ def flash(drawing, data, width, height, reflect, opts=None):
 def render_frame(
     drawing, data, plotter=None, width=600, height=400, reflect=(1, 1), opts=None
 ):
-    """Wrap the renderer so different plugin plotters can be used"""
+    """
+    Wrap the renderer so different plugin plotters can be used. drawing is
+    a drawSvg Drawing, or a raster frame to draw into.
+    """
     opts = opts or {}
     try:
         plotter = globals()[plotter]
     except KeyError:
         plotter = scatter
     return plotter(drawing, data, width, height, reflect, opts)
+
+
+def add_output_arguments(parser):
+    """--type and the frame sink options, for the plotter scripts"""
+    parser.add_argument(
+        "--type",
+        dest="type",
+        action="store",
+        choices=("svg", "raster"),
+        default="svg",
+        help="write svg files, or draw raster frames straight into images "
+        "or a video (implied by --video)",
+    )
+    parser.add_argument(
+        "--precision",
+        dest="precision",
+        type=int,
+        action="store",
+        default=2,
+        help="decimals of svg coordinates",
+    )
+    parser.add_argument(
+        "--tolerance",
+        dest="tolerance",
+        type=float,
+        action="store",
+        help="simplify lines, dropping points closer than this many pixels",
+    )
+    add_sink_arguments(parser)
+
+
+def output_opts(args):
+    """Plotter opts for the add_output_arguments options"""
+    return {"precision": args.precision, "tolerance": args.tolerance}
+
+
+def is_raster(args):
+    """Whether the add_output_arguments options ask for raster frames"""
+    return args.type == "raster" or bool(args.video)